@@ -0,0 +1,146 @@
+import re
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+
+Intent = namedtuple('Intent', ['kind', 'params'])
+
+INTENT_SENSOR_STATS = 'sensor_stats'
+INTENT_RESIDENT_COUNTS = 'resident_counts'
+INTENT_AGENT_STATUSES = 'agent_statuses'
+
+DEFAULT_WINDOW = timedelta(hours=24)
+DEFAULT_PERCENTILES = (50, 90, 95)
+
+# Exact tokens and token prefixes naming each sensor
+SENSOR_TOKENS = {
+    'temp': ({'temp', 'temperature'}, ('температур',)),
+    'humidity': ({'humidity'}, ('влажн',)),
+    'light': ({'light'}, ('освещ', 'свет')),
+    'co2': ({'co2', 'со2'}, ('углекисл',)),
+    'DO': ({'do'}, ('кислород', 'растворенн')),
+    'EC': ({'ec'}, ('электропровод',)),
+    'ph': ({'ph', 'рн'}, ('кислотн', 'водородн')),
+}
+
+AGGREGATE_TOKENS = {
+    'avg': ({'avg', 'average', 'mean'}, ('средн',)),
+    'min': ({'min', 'minimum'}, ('минимум', 'минимальн')),
+    'max': ({'max', 'maximum'}, ('максимум', 'максимальн')),
+    'count': ({'count'}, ('сколько', 'количеств')),
+    'stats': ({'stats', 'statistics'}, ('статистик', 'сводк')),
+    'percentile': ({'percentile', 'percentiles', 'median'}, ('перцентил', 'процентил', 'медиан')),
+}
+
+WINDOW_UNITS = (
+    (('минут', 'minute'), timedelta(minutes=1)),
+    (('час', 'hour'), timedelta(hours=1)),
+    (('сут', 'ден', 'дн', 'day'), timedelta(days=1)),
+    (('недел', 'week'), timedelta(weeks=1)),
+    (('месяц', 'month'), timedelta(days=30)),
+)
+WINDOW_RE = re.compile(r'(?:за|last|past|последн\w*)\s+(?:последн\w*\s+)?(\d+)?\s*([a-zа-я]+)')
+PERCENTILE_RE = re.compile(r'\bp(\d{1,2}(?:\.\d+)?)\b|(\d{1,2}(?:\.\d+)?)\s*(?:-?[a-zа-я]{0,2}\s+)?(?:перцентил|процентил|percentile)')
+
+def tokenize(question):
+    return re.findall(r'\w+', question.lower().replace('ё', 'е'))
+
+def has_token(tokens, exact, prefixes=()):
+    return any(token in exact or (prefixes and token.startswith(prefixes)) for token in tokens)
+
+def parse_window(text):
+    for match in WINDOW_RE.finditer(text):
+        count, unit = match.groups()
+        for prefixes, step in WINDOW_UNITS:
+            if unit.startswith(prefixes):
+                return step * int(count or 1)
+    return DEFAULT_WINDOW
+
+def format_window(window):
+    if window % timedelta(days=1) == timedelta(0):
+        return f"{window.days} сут."
+    if window % timedelta(hours=1) == timedelta(0):
+        return f"{int(window.total_seconds() // 3600)} ч."
+    return f"{int(window.total_seconds() // 60)} мин."
+
+def parse_percentiles(text):
+    values = []
+    for match in PERCENTILE_RE.finditer(text):
+        value = float(match.group(1) or match.group(2))
+        if 0 < value < 100:
+            values.append(value)
+    if not values and ('медиан' in text or 'median' in text):
+        values.append(50.0)
+    return tuple(values) or DEFAULT_PERCENTILES
+
+def match_intent(question):
+    # Returns an Intent for the well-known analytic questions, None otherwise
+    text = question.lower().replace('ё', 'е')
+    tokens = tokenize(question)
+
+    sensors = [name for name, (exact, prefixes) in SENSOR_TOKENS.items() if has_token(tokens, exact, prefixes)]
+    # "do" is a plain English word, only count it as a sensor when written as DO
+    if 'DO' in sensors and 'DO' not in question and not has_token(tokens, set(), SENSOR_TOKENS['DO'][1]):
+        sensors.remove('DO')
+    aggregates = [name for name, (exact, prefixes) in AGGREGATE_TOKENS.items() if has_token(tokens, exact, prefixes)]
+
+    if sensors and aggregates:
+        if 'stats' in aggregates:
+            aggregates = ['min', 'max', 'avg', 'count', 'percentile']
+        params = {
+            'sensors': sensors,
+            'aggregates': aggregates,
+            'window': parse_window(text),
+            'percentiles': parse_percentiles(text) if 'percentile' in aggregates else (),
+        }
+        return Intent(INTENT_SENSOR_STATS, params)
+
+    if has_token(tokens, {'resident', 'residents'}, ('резидент', 'жител')) and \
+            (has_token(tokens, {'count', 'many', 'number'}, ('сколько', 'количеств', 'числ')) or 'stats' in aggregates):
+        group_by = []
+        if has_token(tokens, {'type', 'types'}, ('тип',)):
+            group_by.append('type')
+        if has_token(tokens, {'room', 'rooms'}, ('комнат', 'помещен')):
+            group_by.append('room')
+        return Intent(INTENT_RESIDENT_COUNTS, {'group_by': group_by})
+
+    if has_token(tokens, {'agent', 'agents'}, ('агент',)) and \
+            has_token(tokens, {'status', 'statuses', 'state'}, ('статус', 'состояни')):
+        return Intent(INTENT_AGENT_STATUSES, {})
+
+    return None
+
+def summarize_values(values, percentiles=()):
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return {'count': 0}
+    summary = {
+        'count': int(values.size),
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'avg': float(values.mean()),
+    }
+    if percentiles:
+        summary['percentiles'] = dict(zip(percentiles, np.percentile(values, percentiles).tolist()))
+    return summary
+
+AGGREGATE_LABELS = {'min': 'минимум', 'max': 'максимум', 'avg': 'среднее', 'count': 'измерений'}
+
+def format_number(value):
+    return f"{value:.2f}".rstrip('0').rstrip('.') if isinstance(value, float) else str(value)
+
+def format_sensor_stats(sensor, window, aggregates, summary):
+    if not summary.get('count'):
+        return f"{sensor}: нет данных за {format_window(window)}"
+    parts = [f"{AGGREGATE_LABELS[name]} {format_number(summary[name])}"
+             for name in ('min', 'max', 'avg', 'count') if name in aggregates and summary.get(name) is not None]
+    for percentile, value in summary.get('percentiles', {}).items():
+        parts.append(f"p{format_number(float(percentile))} {format_number(value)}")
+    return f"{sensor} за {format_window(window)}: " + ", ".join(parts)
+
+def format_rows(columns, rows):
+    lines = [" | ".join(columns)]
+    lines.extend(" | ".join(str(value) for value in row) for row in rows)
+    return "\n".join(lines)
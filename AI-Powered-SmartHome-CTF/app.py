@@ -1,19 +1,33 @@
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, abort, render_template_string
+from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, abort, render_template_string, Response, stream_with_context
 import logging
 import threading, requests, os, random, time
-import json, secrets, hashlib
+import json, secrets, hashlib, re, queue, math
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import inspect, text
+from sqlalchemy.pool import QueuePool
 from jinja2 import Template
-import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from requests.exceptions import ConnectTimeout
 import concurrent.futures
 from threading import Lock, RLock
 import atexit
+from dashboard import DASHBOARD
+from live import LIVE, sse_event
+from sqlite_writer import SQLITE_BUSY_TIMEOUT
+from pipeline import Pipeline, Stage, STAGE_OK, STAGE_SKIPPED
+from scheduler import Scheduler, FIXED_RATE, FIXED_DELAY, MISSED_SKIP
+from simulator import SensorSimulator, load_ranges
+from rules import RuleSet, compile_rules
+from cache import TTLCache, PersistentCache, SingleFlight
+from dispatcher import Dispatcher, DispatcherFull, LANE_INTERACTIVE, LANE_PERIODIC, LANE_VALIDATION
+from downsample import lttb
+from analytics import (match_intent, summarize_values, format_sensor_stats, format_rows,
+                       INTENT_SENSOR_STATS, INTENT_RESIDENT_COUNTS, INTENT_AGENT_STATUSES)
+from models import AGENT_UPDATE_HOOKS, NotificationListener, handle_config_notification
+from config_cache import SETTINGS, AGENTS, CONFIG_CHANNEL
 
 
 app = Flask(__name__)
@@ -57,13 +71,58 @@ class ThreadSafeGlobals:
 
 GLOBALS = ThreadSafeGlobals()
 GIGACHAT_URL = f"http://10.63.0.110:8000/oauth/"
-THREAD_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+# Outbound LLM calls, lane: (workers, max queued calls)
+LLM_DISPATCHER = Dispatcher("llm", {
+    LANE_INTERACTIVE: (int(os.environ.get('LLM_INTERACTIVE_WORKERS', '3')), 20),
+    LANE_PERIODIC: (int(os.environ.get('LLM_PERIODIC_WORKERS', '2')), 10),
+    LANE_VALIDATION: (int(os.environ.get('LLM_VALIDATION_WORKERS', '1')), 10),
+})
+CHAT_TIMEOUT = 10
 model_chat_lock = Lock()
 
+# Responses of the agents whose answer only depends on the input readings
+CACHED_AGENTS = (1, 2, 3)
+AGENT_CACHE_DECIMALS = int(os.environ.get('AGENT_CACHE_DECIMALS', '2'))
+AGENT_CACHE = TTLCache(maxsize=int(os.environ.get('AGENT_CACHE_SIZE', '1024')),
+                       ttl=float(os.environ.get('AGENT_CACHE_TTL', '600')))
+AGENT_UPDATE_HOOKS.append(lambda agent_id: AGENT_CACHE.invalidate(lambda key: key[0] == agent_id))
+MODEL_CHAT_FLIGHTS = SingleFlight()
+
+def quantize(value):
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return value.strip()
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return value
+    value = round(float(value), AGENT_CACHE_DECIMALS)
+    return int(value) if value.is_integer() else value
+
+def agent_cache_key(agent_id, system_prompt, prompt):
+    try:
+        payload = json.loads(prompt)
+    except (TypeError, ValueError):
+        payload = None
+    if isinstance(payload, dict):
+        canonical = json.dumps({key: quantize(value) for key, value in payload.items()},
+                               sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    else:
+        canonical = str(prompt).strip()
+    return (agent_id, hashlib.sha256(system_prompt.encode('utf-8')).hexdigest(), canonical)
+
 app.config['JSON_AS_ASCII'] = False
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db/db.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pooled connections keep their pragmas; requests and the writer thread share them
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'poolclass': QueuePool,
+    'pool_size': int(os.environ.get('SQLITE_POOL_SIZE', '8')),
+    'max_overflow': int(os.environ.get('SQLITE_POOL_OVERFLOW', '8')),
+    'pool_timeout': 10,
+    'connect_args': {'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT / 1000},
+}
 app.config['POSTGRES_HOST'] = os.environ.get('POSTGRES_HOST', 'localhost')
 app.config['POSTGRES_PORT'] = os.environ.get('POSTGRES_PORT', '5433')
 
@@ -125,24 +184,22 @@ login_manager.login_view = 'login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-def run_periodically(interval):
-    def wrapper(func):
-        def wrapped_func(*args, **kwargs):
-            try:
-                func(*args, **kwargs)
-                logger.info(f"Func {func.__name__} finished")
-            except Exception as e:
-                logger.error(f"Error in periodic func {func.__name__}: {e}")
-            
-            timer = threading.Timer(interval, wrapped_func, args=args, kwargs=kwargs)
-            timer.daemon = True
-            timer.start()
-            logger.info(f"Next start for periodic func {func.__name__} after {interval} sec")
-        return wrapped_func
-    return wrapper
-
+    return User.get_cached(int(user_id))
+
+AGENT_CYCLE_INTERVAL = int(os.environ.get('AGENT_CYCLE_INTERVAL', '300'))
+AGENT_CYCLE_JITTER = float(os.environ.get('AGENT_CYCLE_JITTER', '5'))
+TIMESERIES_MAINTENANCE_INTERVAL = 3600
+SCHEDULER = Scheduler("periodic-tasks")
+
+AGENT_ROLES = {
+    1: 'life-agent',
+    2: 'eco-agent',
+    3: 'validator-agent',
+    4: 'defender-agent',
+    5: 'randomizer-agent'
+}
+DASHBOARD_SENSORS = ["temp", "light", "co2", "humidity", "DO", "EC", "ph"]
+DASHBOARD_POINTS = 5
 
 @app.route('/')
 def index():
@@ -150,44 +207,24 @@ def index():
     return render_template('index.html', **data)
     
 def get_index_data():
-    db = DatabaseManager()
+    return DASHBOARD.get_or_build(build_index_data).data
 
-    values = [item['sensor_value'] for item in db.get_sensor_value("temp")]
-    tempData = values[-5:]
-
-    values = [item['sensor_value'] for item in db.get_sensor_value("light")]
-    lightData = values[-5:]
-
-    values = [item['sensor_value'] for item in db.get_sensor_value("co2")]
-    coData = values[-5:]
-
-    values = [item['sensor_value'] for item in db.get_sensor_value("humidity")]
-    humidityData = values[-5:]
-
-    values = [item['sensor_value'] for item in db.get_sensor_value("DO")]
-    doData = values[-5:]
-
-    values = [item['sensor_value'] for item in db.get_sensor_value("EC")]
-    ecData = values[-5:]
-
-    values = [item['sensor_value'] for item in db.get_sensor_value("ph")]
-    phData = values[-5:]
+def build_index_data():
+    db = DatabaseManager()
 
-    life_agent_statuses = db.get_agent_status(1)
-    eco_agent_statuses = db.get_agent_status(2)
-    validator_agent_statuses = db.get_agent_status(3)
-    defender_agent_statuses = db.get_agent_status(4)
-    randomizer_agent_statuses = db.get_agent_status(5)
+    sensors = db.get_recent_sensor_values(DASHBOARD_SENSORS, DASHBOARD_POINTS)
+    tempData = sensors['temp']
+    lightData = sensors['light']
+    coData = sensors['co2']
+    humidityData = sensors['humidity']
+    doData = sensors['DO']
+    ecData = sensors['EC']
+    phData = sensors['ph']
+
+    latest_statuses = db.get_latest_statuses()
+    statuses = {role: latest_statuses.get(agent_id, 'unknown') for agent_id, role in AGENT_ROLES.items()}
     
-    statuses = {
-        'life-agent':  life_agent_statuses[-1]['status'],
-        'eco-agent': eco_agent_statuses[-1]['status'],
-        'validator-agent':  validator_agent_statuses[-1]['status'],
-        'defender-agent': defender_agent_statuses[-1]['status'],
-        'randomizer-agent': randomizer_agent_statuses[-1]['status']
-    }
-    
-    residents_status = get_residents_status()
+    residents_status = get_residents_status(latest_statuses)
 
     return {
         'tempData': tempData,
@@ -201,42 +238,39 @@ def get_index_data():
         'residents_status': residents_status
     }
 
-def get_residents_status():
-    db = DatabaseManager()
-    residents = Residents.get_all_residents()
-    
-    life_agent_status = db.get_agent_status(1) 
-    eco_agent_status = db.get_agent_status(2)  
-
-    life_status = life_agent_status[-1]['status'] if life_agent_status else 'unknown'
-    eco_status = eco_agent_status[-1]['status'] if eco_agent_status else 'unknown'
-    
-    residents_with_status = []
-    
-    for resident in residents:
-        if resident.type in ['civilian', 'repairman', 'military']:
-            status = life_status
-            status_class = get_status_class(life_status)
-            emoji = get_resident_emoji(resident.type, life_status)
-        elif resident.type == 'plant':
-            status = eco_status
-            status_class = get_status_class(eco_status)
-            emoji = get_resident_emoji(resident.type, eco_status)
-        else:
-            status = 'unknown'
-            status_class = 'unknown'
-            emoji = '❓'
-        
-        residents_with_status.append({
-            'name': resident.name,
-            'type': resident.type,
-            'room': resident.room,
+LIFE_RESIDENT_TYPES = ('civilian', 'repairman', 'military')
+ECO_RESIDENT_TYPES = ('plant',)
+RESIDENT_TYPES = LIFE_RESIDENT_TYPES + ECO_RESIDENT_TYPES
+RESIDENT_ROOMS = ('room1', 'room2', 'room3', 'room4', 'garden')
+
+def get_type_statuses(latest_statuses):
+    # A resident's status only depends on its type, so it is worked out once per type
+    life_status = latest_statuses.get(1, 'unknown')
+    eco_status = latest_statuses.get(2, 'unknown')
+    type_statuses = {}
+    for resident_type in RESIDENT_TYPES:
+        status = life_status if resident_type in LIFE_RESIDENT_TYPES else eco_status
+        type_statuses[resident_type] = (status, get_status_class(status), get_resident_emoji(resident_type, status))
+    return type_statuses
+
+def get_residents_status(latest_statuses=None):
+    # One entry per (type, room) group instead of one per resident
+    if latest_statuses is None:
+        latest_statuses = DatabaseManager().get_latest_statuses()
+    type_statuses = get_type_statuses(latest_statuses)
+
+    residents_status = []
+    for resident_type, room, count in Residents.get_type_room_counts():
+        status, status_class, emoji = type_statuses.get(resident_type, ('unknown', 'unknown', '❓'))
+        residents_status.append({
+            'type': resident_type,
+            'room': room,
+            'count': count,
             'status': status,
             'status_class': status_class,
             'emoji': emoji
         })
-    
-    return residents_with_status
+    return residents_status
 
 def get_status_class(status):
     status_map = {
@@ -269,16 +303,139 @@ def get_resident_emoji(resident_type, status):
     else:
         return '❓'
 
+MAX_BULK_READINGS = 10000
+# sensors.sensor_name is VARCHAR(255)
+MAX_SENSOR_NAME_LENGTH = 255
+
+def parse_sensor_value(value):
+    # float() also accepts nan and inf, which would poison the rollup sums
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"sensor value must be finite, got {value}")
+    return value
+
+def parse_timestamp(value):
+    # ISO 8601, aware values are converted to the local naive time the database stores
+    timestamp = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+@app.route('/api/sensors/bulk', methods=['POST'])
+@login_required
+def sensors_bulk():
+    data = request.get_json(silent=True)
+    items = data.get('readings') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Expected a non-empty list of readings'}), 400
+    if len(items) > MAX_BULK_READINGS:
+        return jsonify({'error': f'Too many readings, limit is {MAX_BULK_READINGS}'}), 413
+
+    readings = []
+    for index, item in enumerate(items):
+        try:
+            sensor_name = str(item['sensor_name'])
+            if not 0 < len(sensor_name) <= MAX_SENSOR_NAME_LENGTH:
+                raise ValueError(f"sensor_name must be 1 to {MAX_SENSOR_NAME_LENGTH} characters")
+            sensor_value = parse_sensor_value(item['sensor_value'])
+            reading_time = item.get('reading_time')
+            if reading_time is not None:
+                reading_time = parse_timestamp(reading_time)
+            readings.append((sensor_name, sensor_value, reading_time))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            return jsonify({'error': f'Invalid reading at index {index}: {e}', 'index': index}), 400
+
+    inserted = DatabaseManager().insert_cycle(readings)
+    if inserted is None:
+        return jsonify({'error': 'Failed to store readings'}), 500
+    logger.info(f"Bulk sensor upload by user: {current_user.id}, readings: {inserted}")
+    return jsonify({'inserted': inserted})
+
+SERIES_DEFAULT_WINDOW = timedelta(hours=1)
+SERIES_DEFAULT_POINTS = 200
+SERIES_MAX_POINTS = 2000
+
+LIVE_KEEPALIVE = 15
+
+@app.route('/api/live')
+def live_updates():
+    subscriber = LIVE.subscribe()
+    if subscriber is None:
+        response = jsonify({'error': 'Too many live clients, try again later'})
+        response.headers['Retry-After'] = str(LIVE_KEEPALIVE)
+        return response, 503
+
+    def generate():
+        try:
+            yield f"retry: {LIVE_KEEPALIVE * 1000}\n\n"
+            while not subscriber.closed:
+                message = subscriber.get(timeout=LIVE_KEEPALIVE)
+                # Comment lines keep proxies from closing an idle stream
+                yield message if message is not None else ": keepalive\n\n"
+        finally:
+            LIVE.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/sensors/<sensor_name>/series')
+def sensor_series(sensor_name):
+    # Downsampled series for charts. With since= only points newer than it
+    # are returned, so pollers fetch just what they have not seen yet.
+    try:
+        end = parse_timestamp(request.args['to']) if request.args.get('to') else datetime.now()
+        start = parse_timestamp(request.args['from']) if request.args.get('from') else end - SERIES_DEFAULT_WINDOW
+        since = parse_timestamp(request.args['since']) if request.args.get('since') else None
+        points = min(max(int(request.args.get('points', SERIES_DEFAULT_POINTS)), 3), SERIES_MAX_POINTS)
+    except ValueError:
+        return jsonify({'error': 'from, to and since must be ISO timestamps and points a number'}), 400
+    if start >= end:
+        return jsonify({'error': 'from must be before to'}), 400
+
+    db = DatabaseManager()
+    # Nothing new for this sensor means the same answer as last time
+    last_reading = db.get_sensor_last_reading(sensor_name)
+    etag = hashlib.sha1(json.dumps([sensor_name, request.args.get('from'), request.args.get('to'),
+                                    request.args.get('since'), points, str(last_reading)]).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    if since is not None:
+        start = max(start, since)
+    resolution, rows = db.get_sensor_series(sensor_name, start, end)
+    if resolution is None:
+        return jsonify({'error': 'Failed to load sensor series'}), 500
+    if since is not None:
+        rows = [row for row in rows if row['time'] > since]
+
+    if len(rows) > points:
+        times = [row['time'].timestamp() for row in rows]
+        rows = [rows[i] for i in lttb(times, [row['value'] for row in rows], points)]
+
+    response = jsonify({
+        'sensor': sensor_name,
+        'resolution': resolution,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'points': [[row['time'].isoformat(), float(row['value'])] for row in rows],
+        'last': rows[-1]['time'].isoformat() if rows else request.args.get('since'),
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/account', methods=['GET', 'POST'])
 @login_required
 def account():
     user = current_user
     cookie = request.cookies['session']
     
-    chat_history = ChatHistory.get_user_chat_history(user.id, limit=20)
+    chat_history, next_before = ChatHistory.get_chat_page(user.id, limit=CHAT_PAGE_SIZE)
     
     formatted_history = []
-    for chat in chat_history:
+    for chat in reversed(chat_history):
         formatted_history.append({
             'role': 'user' if chat.message_type == 'ai_chat' else 'user',
             'content': chat.message if chat.message_type == 'ai_chat' else f"Запрос к БД: {chat.message}",
@@ -294,8 +451,40 @@ def account():
                          user=user, 
                          cookie=cookie,
                          chat_history=formatted_history,
+                         next_before=format_chat_cursor(next_before),
                          now=datetime.now())
 
+CHAT_PAGE_SIZE = 20
+CHAT_PAGE_MAX_SIZE = 100
+
+def format_chat_cursor(cursor):
+    return f"{cursor[0].isoformat()},{cursor[1]}" if cursor else None
+
+def parse_chat_cursor(value):
+    timestamp, chat_id = value.rsplit(',', 1)
+    return datetime.fromisoformat(timestamp), int(chat_id)
+
+@app.route('/api/chat/history')
+@login_required
+def chat_history_page():
+    try:
+        before = parse_chat_cursor(request.args['before']) if request.args.get('before') else None
+        limit = min(max(int(request.args.get('limit', CHAT_PAGE_SIZE)), 1), CHAT_PAGE_MAX_SIZE)
+    except ValueError:
+        return jsonify({'error': 'before must be <timestamp>,<id> and limit a number'}), 400
+
+    chats, next_before = ChatHistory.get_chat_page(current_user.id, before=before, limit=limit)
+    return jsonify({
+        'messages': [{
+            'id': chat.id,
+            'message': chat.message,
+            'response': chat.response,
+            'message_type': chat.message_type,
+            'timestamp': chat.timestamp.isoformat() if chat.timestamp else None,
+        } for chat in chats],
+        'next_before': format_chat_cursor(next_before),
+    })
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -328,8 +517,7 @@ def register():
         else:
             new_user = User(username=username, role='user')
             new_user.set_password(password)
-            sqlitedb.session.add(new_user)
-            sqlitedb.session.commit()
+            SQLITE_WRITER.run(lambda session: session.add(new_user))
             flash('Sign-up success!', 'success')
             logger.warning(f'Sign up success: {username}')
             return render_template('login.html')
@@ -351,11 +539,7 @@ def agents():
 def get_agents_data():
     db = DatabaseManager()
     agents = db.get_all_agents()
-    life_agent_statuses = db.get_agent_status(1)
-    eco_agent_statuses = db.get_agent_status(2)
-    validator_agent_statuses = db.get_agent_status(3)
-    defender_agent_statuses = db.get_agent_status(4)
-    randomizer_agent_statuses = db.get_agent_status(5)
+    latest_statuses = db.get_latest_statuses()
 
     changes = Changes.get_changes()
 
@@ -375,15 +559,17 @@ def get_agents_data():
 
     return {
         'life_agent_prompt': agents[0]['system_prompt'],
-        'life_agent_logs': life_agent_statuses[-1]['status'],
+        'life_agent_logs': latest_statuses.get(1, 'unknown'),
+        'life_agent_rules': format_rules(agents[0].get('rules')),
         'eco_agent_prompt': agents[1]['system_prompt'],
-        'eco_agent_logs': eco_agent_statuses[-1]['status'],
+        'eco_agent_logs': latest_statuses.get(2, 'unknown'),
+        'eco_agent_rules': format_rules(agents[1].get('rules')),
         'validator_agent_prompt': agents[2]['system_prompt'],
-        'validator_agent_logs': validator_agent_statuses[-1]['status'],
+        'validator_agent_logs': latest_statuses.get(3, 'unknown'),
         'defender_agent_prompt': agents[3]['system_prompt'],
-        'defender_agent_logs': defender_agent_statuses[-1]['status'],
+        'defender_agent_logs': latest_statuses.get(4, 'unknown'),
         'randomizer_agent_prompt': agents[4]['system_prompt'],
-        'randomizer_agent_logs': randomizer_agent_statuses[-1]['status'],
+        'randomizer_agent_logs': latest_statuses.get(5, 'unknown'),
         'chat_prompt':agents[5]['system_prompt'],
         'validate_requests': validate_requests,
         'gigachat_url': gigachat_url,
@@ -391,6 +577,44 @@ def get_agents_data():
         'changes': changes
     }
 
+# Rule edits are queued as changes for this agent name plus the suffix
+RULES_CHANGE_SUFFIX = ':rules'
+
+def format_rules(rules):
+    return json.dumps(rules, indent=2, ensure_ascii=False) if rules else ''
+
+@app.route('/save_rules', methods=['POST'])
+@login_required
+def save_rules():
+    agent_name = request.form.get('agent', '').strip()
+    rules_text = request.form.get('rules', '').strip()
+
+    if agent_name not in ('life-agent', 'eco-agent'):
+        flash('Rules are supported only for life-agent and eco-agent')
+    else:
+        try:
+            rules = json.loads(rules_text)
+            RuleSet(rules)
+        except Exception as e:
+            rules = None
+            flash(f'Invalid rules: {e}')
+            logger.warning(f'Invalid rules for {agent_name} from user: {current_user.id}: {e}')
+        if rules is not None:
+            db = DatabaseManager()
+            agent = db.get_agent(db.get_agent_id_by_role(agent_name))
+            old_text = format_rules(agent.get('rules'))
+            new_text = format_rules(rules)
+            if new_text == old_text:
+                flash("No changes detected")
+            else:
+                Changes.save_changes(agent_name=agent_name + RULES_CHANGE_SUFFIX, old_text=old_text, new_text=new_text,
+                                     validated=0, user_id=current_user.id)
+                flash('Rules sent for validation!')
+                logger.info(f'Rules sent for validation: agent={agent_name}, rules={rules_text}, user_id={current_user.id}')
+
+    data = get_agents_data()
+    return render_template('agents.html', **data)
+
 @app.route('/validate_prompt', methods=['POST'])
 @login_required
 def validate_prompt():
@@ -448,7 +672,8 @@ def validate_prompt():
 @app.route('/validate/<int:change_id>', methods=['POST'])
 def validate_change(change_id):
     change = Changes.query.get_or_404(change_id)
-    change.validated = not change.validated  
+    # Not written back, the change row is deleted by the writer thread
+    validated = not change.validated
     
     if current_user.id == change.user_id:
         flash('Validation by another user is required')
@@ -457,23 +682,47 @@ def validate_change(change_id):
         return render_template('agents.html', **data)
 
     db = DatabaseManager()
-    agent_id = db.get_agent_id_by_role(change.agent_name)
-    agent = db.update_agent(agent_id, change.new_text)
+    if change.agent_name.endswith(RULES_CHANGE_SUFFIX):
+        agent_id = db.get_agent_id_by_role(change.agent_name[:-len(RULES_CHANGE_SUFFIX)])
+        agent = db.update_agent_rules(agent_id, json.loads(change.new_text))
+    else:
+        agent_id = db.get_agent_id_by_role(change.agent_name)
+        agent = db.update_agent(agent_id, change.new_text)
     new_text = change.new_text
     if agent:
-        sqlitedb.session.delete(change)
-        sqlitedb.session.commit()
-        flash('The change was successfully validated!' if change.validated else 'Change cancelled.')
+        Changes.delete_change(change.change_id)
+        flash('The change was successfully validated!' if validated else 'Change cancelled.')
         logger.info(f"change successfully validated by user: {current_user}, для agent_id: {agent_id}, new text: {new_text}")
     data = get_agents_data()
     return render_template('agents.html', **data)
 
+RESIDENTS_PAGE_SIZE = 50
+RESIDENTS_PAGE_MAX_SIZE = 200
+
+def render_residents():
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', RESIDENTS_PAGE_SIZE, type=int)
+    per_page = max(1, min(per_page, RESIDENTS_PAGE_MAX_SIZE))
+    search = request.args.get('q', '').strip()
+    room = request.args.get('room', '').strip()
+    resident_type = request.args.get('type', '').strip()
+
+    pagination = Residents.get_residents_page(page=max(page, 1), per_page=per_page, search=search,
+                                              room=room, resident_type=resident_type)
+    return render_template('residents.html',
+                         residents=pagination.items,
+                         pagination=pagination,
+                         room_counts=Residents.get_room_counts(),
+                         search=search,
+                         room=room,
+                         resident_type=resident_type,
+                         rooms=RESIDENT_ROOMS,
+                         resident_types=RESIDENT_TYPES,
+                         current_user=current_user)
+
 @app.route('/residents', methods=['GET'])
 def residents():
-    residents = Residents.get_all_residents()    
-    return render_template('residents.html', 
-                         residents=residents, 
-                         current_user=current_user)
+    return render_residents()
 
 @app.route('/add_resident', methods=['POST'])
 def add_resident():
@@ -486,8 +735,7 @@ def add_resident():
     logger.info(f'New resident: {name} Room: {room} Type: {resident_type}')
     flash(f"New resident: {resident.voucher}")
 
-    residents = Residents.get_all_residents()  
-    return render_template('residents.html',current_user = current_user, residents = residents)
+    return render_residents()
 
 @app.route('/resident/<int:resident_id>')
 def resident_details(resident_id):
@@ -541,6 +789,16 @@ def save_settings():
     data = get_agents_data()
     return render_template('agents.html', **data)
 
+DB_KEYWORDS = [
+    'select', 'insert', 'update', 'delete', 'create', 'alter', 'drop',
+    'показать', 'вывести', 'найти', 'поиск', 'сколько', 'статистик',
+    'список', 'перечень', 'отчет', 'анализ', 'данные', 'информация',
+    'количество', 'сумма', 'среднее', 'максимум', 'минимум',
+    'пользовател', 'юзер', 'user', 'агент', 'agent', 'сенсор', 'sensor',
+    'резидент', 'resident', 'настройк', 'setting', 'изменен', 'change',
+    'флаг', 'flag', 'логи', 'log', 'статус', 'status', 'база', 'таблиц'
+]
+
 @app.route('/chat', methods=['POST'])
 @limiter.limit("10 per minute", key_func=get_user_identifier)
 def chat():
@@ -554,58 +812,37 @@ def chat():
     try:
         def is_database_related(query):
             query_lower = query.lower()
-            
-            db_keywords = [
-                'select', 'insert', 'update', 'delete', 'create', 'alter', 'drop',
-                'показать', 'вывести', 'найти', 'поиск', 'сколько', 'статистик',
-                'список', 'перечень', 'отчет', 'анализ', 'данные', 'информация',
-                'количество', 'сумма', 'среднее', 'максимум', 'минимум',
-                'пользовател', 'юзер', 'user', 'агент', 'agent', 'сенсор', 'sensor',
-                'резидент', 'resident', 'настройк', 'setting', 'изменен', 'change',
-                'флаг', 'flag', 'логи', 'log', 'статус', 'status', 'база', 'таблиц'
-            ]
-            
-            return any(keyword in query_lower for keyword in db_keywords)
+            return any(keyword in query_lower for keyword in DB_KEYWORDS)
         
         user_id = current_user.id if current_user.is_authenticated else None
+
+        # Plain chat can be streamed, database answers are always sent whole
+        if data.get('stream') and not (is_database_related(user_query) and user_id):
+            return stream_chat(user_query, user_id)
         response_text = ""
         message_type = "ai_chat"
         
         if is_database_related(user_query) and user_id:
             try:
-                db_result = natural_language_to_sql(user_query)
+                db_result = answer_analytics(user_query)
+                if db_result is None:
+                    db_result = natural_language_to_sql(user_query)
                 
                 if not any(error in db_result.lower() for error in ['ошибка', 'error', 'не найдены']):
                     response_text = f"📊 Результат из базы данных:\n{db_result}"
                     message_type = "db_query"
                 else:
-                    regular_response = model_chat(user_query, 6)
-                    response_data = json.loads(regular_response)
-                    response_text = response_data['choices'][0]['message']['content']
+                    response_text = chat_answer(user_query, user_id)
                     message_type = "ai_chat"
                     
+            except DispatcherFull:
+                raise
             except Exception as db_error:
                 logger.warning(f"Database query failed, falling back to regular chat: {db_error}")
-                regular_response = model_chat(user_query, 6)
-                response_data = json.loads(regular_response)
-                response_text = response_data['choices'][0]['message']['content']
+                response_text = chat_answer(user_query, user_id)
                 message_type = "ai_chat"
         else:
-            future = model_chat_async(user_query, 6)
-            try:
-                regular_response = future.result(timeout=10)  
-                if regular_response:
-                    response_data = json.loads(regular_response)
-                    response_text = response_data['choices'][0]['message']['content']
-                else:
-                    response_text = "Извините, произошла ошибка при обработке запроса"
-            except concurrent.futures.TimeoutError:
-                response_text = "Извините, время обработки запроса истекло. Попробуйте позже."
-                logger.warning(f"Chat request timeout for user: {user_id}")
-            except Exception as e:
-                response_text = "Извините, произошла ошибка при обработке запроса"
-                logger.error(f"Error in async chat processing: {e}")
-            
+            response_text = chat_answer(user_query, user_id)
             message_type = "ai_chat"
         
         if user_id:
@@ -618,10 +855,30 @@ def chat():
         
         return jsonify({'response': response_text})
     
+    except DispatcherFull as e:
+        logger.warning(f"Chat rejected for user: {current_user.get_id()}, {e}")
+        response = jsonify({'response': 'Сервис перегружен, попробуйте позже.'})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
     except Exception as e:
         logger.error(f'Chat processing error: {e}')
         return jsonify({'response': f'Ошибка обработки запроса: {str(e)}'}), 500
     
+def chat_answer(user_query, user_id):
+    # Chat reply through the interactive lane; raises DispatcherFull when it is full
+    future = model_chat_async(user_query, 6, lane=LANE_INTERACTIVE, timeout=CHAT_TIMEOUT)
+    try:
+        regular_response = future.result(timeout=CHAT_TIMEOUT)
+        if regular_response:
+            response_data = json.loads(regular_response)
+            return response_data['choices'][0]['message']['content']
+    except concurrent.futures.TimeoutError:
+        logger.warning(f"Chat request timeout for user: {user_id}")
+        return "Извините, время обработки запроса истекло. Попробуйте позже."
+    except Exception as e:
+        logger.error(f"Error in async chat processing: {e}")
+    return "Извините, произошла ошибка при обработке запроса"
+
 def model_chat(prompt,agent_id):
         current_token = GLOBALS.BEARER_TOKEN
         # 1 - life-agent 
@@ -640,6 +897,13 @@ def model_chat(prompt,agent_id):
         
         system_prompt = agent['system_prompt']
         role = agent['role']
+
+        cache_key = agent_cache_key(agent_id, system_prompt, prompt) if agent_id in CACHED_AGENTS else None
+        if cache_key is not None:
+            cached = AGENT_CACHE.get(cache_key)
+            if cached is not None:
+                logger.info(f"Role: {role}, User prompt: {prompt}, cached response: {cached}")
+                return cached
         
         headers = {'Authorization': f'Bearer {current_token}'}
         payload = {
@@ -664,6 +928,8 @@ def model_chat(prompt,agent_id):
                 
                 if response.status_code == 200:    
                     logger.info(f"Role: {role}, System prompt: {system_prompt}, User prompt: {prompt}, Response: {response.text}")    
+                    if cache_key is not None:
+                        AGENT_CACHE.set(cache_key, response.text)
                     return response.text
                 if response.status_code == 401:
                     logger.info("Trying to update BEARER Token")
@@ -673,6 +939,8 @@ def model_chat(prompt,agent_id):
                     Settings.save_setting('bearer_token', new_token)
                     response = requests.post('http://10.63.0.110:8000/chat/completions', headers=headers, json=payload, timeout=30)
                     logger.info(f"Role: {role}, System prompt: {system_prompt}, User prompt: {prompt}, Response: {response.text}")
+                    if cache_key is not None and response.status_code == 200:
+                        AGENT_CACHE.set(cache_key, response.text)
                     return response.text
                 if response.status_code == 429:
                     retry_after = int(response.headers.get('Retry-After', retry_delay))
@@ -702,23 +970,219 @@ def model_chat(prompt,agent_id):
             logger.error(f"Error connecting to GigaChat: {e}")
             return None
 
-def model_chat_async(prompt, agent_id, callback=None):
+STREAM_END = object()
+
+def stream_chat(user_query, user_id):
+    # The gateway stream is read on an interactive lane worker, so streamed
+    # chats share the lane's limits; raises DispatcherFull when it is full
+    chunks = queue.Queue()
+
+    def produce():
+        for delta in model_chat_stream(user_query, 6):
+            chunks.put(delta)
+
+    future = LLM_DISPATCHER.submit(LANE_INTERACTIVE, produce, timeout=CHAT_TIMEOUT)
+    # Also runs when the call expired in the queue and produce() never started
+    future.add_done_callback(lambda done: chunks.put(STREAM_END))
+
+    def generate():
+        parts = []
+        while True:
+            delta = chunks.get()
+            if delta is STREAM_END:
+                break
+            parts.append(delta)
+            yield sse_event({'delta': delta})
+        try:
+            future.result()
+        except Exception as e:
+            logger.error(f"Error in streaming chat: {e}")
+        response_text = "".join(parts) or "Извините, произошла ошибка при обработке запроса"
+
+        if user_id:
+            ChatHistory.save_chat_message(
+                user_id=user_id,
+                message=user_query,
+                response=response_text,
+                message_type="ai_chat"
+            )
+        yield sse_event({'response': response_text}, event='done')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def model_chat_stream(prompt, agent_id):
+    # Yields pieces of the answer as the gateway sends them
+    agent = DatabaseManager().get_agent(agent_id)
+    payload = {
+        "model": "GigaChat",
+        "messages": [
+            {"role": "system", "content": agent['system_prompt']},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": 500,
+        "stream": True,
+        "update_interval": 0
+    }
+
+    for attempt in range(2):
+        headers = {'Authorization': f'Bearer {GLOBALS.BEARER_TOKEN}'}
+        response = requests.post('http://10.63.0.110:8000/chat/completions', headers=headers, json=payload,
+                                 timeout=30, stream=True)
+        if response.status_code != 401 or attempt:
+            break
+        response.close()
+        logger.info("Trying to update BEARER Token")
+        new_token = requests.post(GIGACHAT_URL, timeout=30).json().get('access_token')
+        GLOBALS.update_bearer_token(new_token)
+        Settings.save_setting('bearer_token', new_token)
+
+    with response:
+        if response.status_code != 200:
+            raise Exception(f"GigaChat returned status {response.status_code}")
+        if 'text/event-stream' not in response.headers.get('Content-Type', ''):
+            # The gateway answered without streaming
+            yield response.json()['choices'][0]['message']['content']
+            return
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            chunk = line[len('data:'):].strip()
+            if chunk == '[DONE]':
+                break
+            delta = json.loads(chunk)['choices'][0].get('delta', {}).get('content')
+            if delta:
+                yield delta
+    logger.info(f"Role: {agent['role']}, User prompt: {prompt}, streamed response finished")
+
+def model_chat_key(prompt, agent_id):
+    agent = DatabaseManager().get_agent(6 if agent_id == "" else agent_id)
+    system_prompt = agent['system_prompt'] if agent else ''
+    return (agent_id, hashlib.sha256(system_prompt.encode('utf-8')).hexdigest(), prompt)
+
+def model_chat_async(prompt, agent_id, callback=None, lane=LANE_INTERACTIVE, priority=0, timeout=None):
+    # Identical requests that are already running share the same future.
+    # Raises DispatcherFull when the lane queue is full; timeout drops the
+    # call if it is still queued after that many seconds.
     def task():
         try:
-            result = model_chat(prompt, agent_id)
-            if callback:
-                callback(result)
-            return result
+            return model_chat(prompt, agent_id)
         except Exception as e:
             logger.error(f"Error in async model_chat: {e}")
-            if callback:
-                callback(None)
             return None
-    
-    future = THREAD_POOL.submit(task)
+
+    future = MODEL_CHAT_FLIGHTS.submit(
+        model_chat_key(prompt, agent_id),
+        lambda: LLM_DISPATCHER.submit(lane, task, priority=priority, timeout=timeout))
+    if callback:
+        # Cancelled, timed out or full-lane calls reach the callback as None
+        future.add_done_callback(
+            lambda done: callback(None if done.cancelled() or done.exception() else done.result()))
     return future
 
-@run_periodically(300)
+SENSOR_REQUEST = '{"temp":"","humidity":"", "light": "", "co2": "", "DO": "","EC": "", "ph": ""}'
+LIFE_SENSORS = ["temp", "humidity", "light", "co2"]
+ECO_SENSORS = ["DO", "EC", "ph"]
+AGENT_STAGE_TIMEOUT = 65
+
+# 'simulator' generates readings locally, 'llm' asks the randomizer-agent
+RANDOMIZER_BACKEND = os.environ.get('RANDOMIZER_BACKEND', 'simulator')
+SIMULATOR = SensorSimulator(
+    ranges=load_ranges(os.environ.get('SENSOR_SIMULATOR_RANGES')),
+    model=os.environ.get('SENSOR_SIMULATOR_MODEL', 'uniform'),
+)
+
+def parse_agent_output(out, agent_name):
+    if out is None:
+        raise Exception(f"No response from {agent_name}")
+    try:
+        parsed_out = json.loads(out)
+        return json.loads(parsed_out['choices'][0]['message']['content'])
+    except json.JSONDecodeError as e:
+        logger.error(f"Error on parsing json from {agent_name}: {e}, {e.doc}")
+        if not GLOBALS.VALIDATION_ENABLED:
+            raise
+        corrected_out = model_chat_async(out, 3, lane=LANE_VALIDATION, timeout=30).result(timeout=30)
+        logger.info(f"Validated response from {agent_name}: {corrected_out}")
+        parsed_out = json.loads(corrected_out)
+        return json.loads(parsed_out['choices'][0]['message']['content'])
+
+def sensor_prompt(readings, sensor_names):
+    return "{" + ", ".join(f'"{name}": {readings[name]}' for name in sensor_names) + "}"
+
+#randomizer-agent - 5
+def randomizer_stage(inputs):
+    if RANDOMIZER_BACKEND == 'llm':
+        return llm_randomizer()
+    readings = {}
+    for name, value in SIMULATOR.sample().items():
+        logger.info(f"Sensor data - {name}:{value}")
+        readings[name] = str(value)
+    return readings
+
+def llm_randomizer():
+    out = model_chat_async(SENSOR_REQUEST, 5, lane=LANE_PERIODIC, priority=1, timeout=30).result(timeout=30)
+    logger.info(f"Randomizer-agent response: {out}")
+    if out is None:
+        raise Exception("Error on get output from Gigachat")
+
+    required_vars = ["temp", "humidity", "light", "co2", "DO", "EC", "ph", "choices", "message", "content"]
+    missing_variables = [var for var in required_vars if var not in out]
+    if len(missing_variables) > 0:
+        logger.warning(f"Missing variables in response from randomizer-agent: {', '.join(missing_variables)}")
+
+    content_data = parse_agent_output(out, "randomizer-agent")
+    readings = {}
+    for name, value in content_data.items():
+        logger.info(f"Sensor data - {name}:{value}")
+        readings[name] = str(value)
+    return readings
+
+def classify_readings(agent_id, agent_name, readings, sensor_names):
+    # Thresholds are checked locally; the LLM is only asked when the rules
+    # say so (readings close to a threshold, or escalate = always)
+    agent = DatabaseManager().get_agent(agent_id)
+    rule_set = None
+    rule_status = None
+    if agent and agent.get('rules'):
+        try:
+            rule_set = compile_rules(agent['rules'])
+        except Exception as e:
+            logger.error(f"Invalid rules for {agent_name}: {e}")
+    if rule_set is not None:
+        rule_status, near_boundary = rule_set.classify(readings)
+        if not rule_set.needs_llm(near_boundary):
+            logger.info(f"{agent_name} status by rules - {rule_status}")
+            return rule_status
+        logger.info(f"{agent_name} escalated to LLM, rules status - {rule_status}")
+
+    try:
+        out = model_chat_async(sensor_prompt(readings, sensor_names), agent_id,
+                               lane=LANE_PERIODIC, timeout=30).result(timeout=30)
+        logger.info(f"{agent_name} response: {out}")
+        content_data = parse_agent_output(out, agent_name)
+        logger.info(f"{agent_name} status - {content_data}")
+        return str(content_data["system_status"])
+    except Exception as e:
+        if rule_status is None:
+            raise
+        logger.error(f"Error get output from {agent_name}, using rules status {rule_status}: {e}")
+        return rule_status
+
+#life-agent - 1
+def life_agent_stage(inputs):
+    return classify_readings(1, "life-agent", inputs['randomizer'], LIFE_SENSORS)
+
+#eco-agent - 2
+def eco_agent_stage(inputs):
+    return classify_readings(2, "eco-agent", inputs['randomizer'], ECO_SENSORS)
+
+AGENT_PIPELINE = Pipeline("agents-cycle", [
+    Stage("randomizer", randomizer_stage, timeout=AGENT_STAGE_TIMEOUT),
+    Stage("life", life_agent_stage, depends_on=["randomizer"], timeout=AGENT_STAGE_TIMEOUT),
+    Stage("eco", eco_agent_stage, depends_on=["randomizer"], timeout=AGENT_STAGE_TIMEOUT),
+])
+
 def my_function():
     current_token = GLOBALS.BEARER_TOKEN
     global HOST 
@@ -729,199 +1193,199 @@ def my_function():
     logger.info("Updating agents parameters")
     with app.app_context():
         db = DatabaseManager()
-            
-        content_data = ""
-        #randomizer-agent - 5
-        try:
-            future = model_chat_async('{"temp":"","humidity":"", "light": "", "co2": "", "DO": "","EC": "", "ph": ""}', 5)
-            out = future.result(timeout=30)  
-            logger.info(f"Randomizer-agent response: {out}")
-            if out == None:
-                raise Exception("Error on get output from Gigachat")
-            else:
-                 db.insert_agent_status(5,"normal")
-        except Exception as e:
-            logger.error(f"Error get output from Gigachat: {out}, {e}")
-            raise
-        try:
-            required_vars = ["temp", "humidity", "light", "co2", "DO", "EC", "ph", "choices", "message", "content"]
-            missing_variables = []
-            for var in required_vars:
-                if var not in out:
-                    missing_variables.append(var)
-
-            if len(missing_variables) > 0:
-                logger.warning(f"Missing variables in response from randomizer-agent: {', '.join(missing_variables)}")
-
-            parsed_out = json.loads(out)
-            first_choice = parsed_out['choices'][0]
-            content_str = first_choice['message']['content']
-            content_data = json.loads(content_str)
-        except json.JSONDecodeError as e:  
-            logger.error(f"Error on parsing json from randomizer-agent: {e}, {e.doc}")
-            if GLOBALS.VALIDATION_ENABLED:
-                future = model_chat_async(out, 3)
-                coreccted_out = future.result(timeout=30)
-                logger.info(f"Validated response from randomizer-agent: {out}")
-                parsed_out = json.loads(coreccted_out)
-                first_choice = parsed_out['choices'][0]
-                content_str = first_choice['message']['content']
-                content_data = json.loads(content_str)
-        except Exception as e:   
-            logger.error(f"Error on parsing response from randomizer-agent: {e} out = {out}")
-        
-        attr_dict = {}
-        try:
-            for attr in content_data.items():
-                logger.info(f"Sensor data - {attr[0]}:{attr[1]}")
-                attr_dict[attr[0]] = str(attr[1])
-                db.insert_sensor_value(attr[0],attr[1])
-        except Exception as e:        
-                logger.error(f"Error on input to db sensor parameters from randomizer-agent: {e}")
-                db.insert_agent_status(5,"critical")
-    
-        out_prompt = ""
-        #life-agent - 1
-        try:
-            out_prompt = f'{{"temp": {attr_dict["temp"]}, "humidity": {attr_dict["humidity"]}, "light": {attr_dict["light"]}, "co2": {attr_dict["co2"]}}}'
-        except Exception as e:  
-            logger.error(f"Error on decoding response with sensors parameters from Life-agent: {e}")
-
-        future = model_chat_async(out_prompt, 1)
-        
-        try:
-            life_agent_out = future.result(timeout=30)
-            logger.info(f"Life-agent response: {life_agent_out}")
-            required_vars = ["message", "content", "system_status"]
-            missing_variables = []
-            for var in required_vars:
-                if var not in life_agent_out:
-                    missing_variables.append(var)
-
-            if len(missing_variables) > 0:
-                logger.warning(f"Missing variables in response from life-agent: {', '.join(missing_variables)}")
-        except Exception as e:
-            logger.error(f"Error on parsing response from Life-agent: {e}")
-            
-        try:
-            parsed_out = json.loads(life_agent_out)
-            first_choice = parsed_out['choices'][0]
-            content_str = first_choice['message']['content']
-            content_data = json.loads(content_str)
-        except json.JSONDecodeError as e:  
-            logger.error(f"Error on parsing output from life-agent:  {e}, {e.doc}")
-            if GLOBALS.VALIDATION_ENABLED:
-                coreccted_out = model_chat(parsed_out,3)
-                logger.info(f"Validated response from life-agent: {out}")
-                parsed_out = json.loads(coreccted_out)
-                first_choice = parsed_out['choices'][0]
-                content_str = first_choice['message']['content']
-                content_data = json.loads(content_str)
-        except Exception as e:
-            logger.error(f"Error on getting output from life-agent: {e}")
 
-        attr_life_dict = {}
-        try:
-            for attr in content_data.items():
-                logger.info(f"Life-agent status - {attr[0]}:{attr[1]}")
-                attr_life_dict[attr[0]] = str(attr[1])
-                db.insert_agent_status(1,attr_life_dict["system_status"])
-        except Exception as e:        
-                logger.error(f"Error on gettint output from life-agent: {e}")
-                db.insert_agent_status(1,"Critical")
-
-        #eco-agent - 2
-        try:
-            out_prompt = f'{{"DO": {attr_dict["DO"]}, "EC": {attr_dict["EC"]}, "ph": {attr_dict["ph"]}}}'
-        except Exception as e: 
-            logger.error(f"Error on parsing response with sensor parameters from Eco-agent: {e}")
-        
-        future = model_chat_async(out_prompt, 2)
-        try:
-            eco_agent_out = future.result(timeout=30)
-            logger.info(f"Eco-agent response: {eco_agent_out}")
-            parsed_out = json.loads(eco_agent_out)
-            first_choice = parsed_out['choices'][0]
-            content_str = first_choice['message']['content']
-            content_data = json.loads(content_str)
-        except json.JSONDecodeError as e:  
-            logger.error(f"Error on parsing output from eco-agent: {e}, {e.doc}")
-            if GLOBALS.VALIDATION_ENABLED:
-                coreccted_out = model_chat(parsed_out,3)
-                logger.info(f"Validated output from Eco-agent: {out}")
-                parsed_out = json.loads(coreccted_out)
-                first_choice = parsed_out['choices'][0]
-                content_str = first_choice['message']['content']
-                content_data = json.loads(content_str)
-        except Exception as e:
-            logger.error(f"Error on parsing output from eco-agent: {e}")
-
-        attr_eco_dict = {}
-        try:
-            for attr in content_data.items():
-                logger.info(f"Eco-agent status - {attr[0]}:{attr[1]}")
-                attr_eco_dict[attr[0]] = str(attr[1])
-                db.insert_agent_status(2,attr_eco_dict["system_status"])
-        except Exception as e:        
-                logger.error(f"Error on getting output from eco-agent: {e}")
-                db.insert_agent_status(2,"Critical")
+        results = AGENT_PIPELINE.run()
+        # Stamped here so the pushed readings carry the same time as the stored ones
+        reading_time = datetime.now()
+        readings = []
+        statuses = []
+
+        randomizer = results['randomizer']
+        if randomizer.status == STAGE_OK:
+            for name, value in randomizer.value.items():
+                try:
+                    readings.append((name, parse_sensor_value(value), reading_time))
+                except ValueError as e:
+                    logger.error(f"Skipping sensor value from randomizer-agent - {name}:{value}: {e}")
+            statuses.append((5, "normal"))
+        else:
+            logger.error(f"Error get output from randomizer-agent: {randomizer.status}, {randomizer.error}")
+            statuses.append((5, "critical"))
+
+        # Each agent status is written on its own, whatever happened to the other one
+        for agent_id, stage_name in [(1, "life"), (2, "eco")]:
+            result = results[stage_name]
+            if result.status == STAGE_OK:
+                statuses.append((agent_id, result.value))
+            elif result.status != STAGE_SKIPPED:
+                logger.error(f"Error on getting output from {stage_name}-agent: {result.status}, {result.error}")
+                statuses.append((agent_id, "Critical"))
+
+        stored = db.insert_cycle(readings, statuses)
+
+        DASHBOARD.refresh(build_index_data)
+        # Dashboards are only told about what actually got stored
+        if stored is not None:
+            publish_cycle(reading_time, readings, statuses)
+
+def publish_cycle(reading_time, readings, statuses):
+    # Only what this cycle wrote goes to the connected dashboards
+    agent_statuses = {AGENT_ROLES[agent_id]: status for agent_id, status in statuses}
+    delta = {
+        'time': reading_time.isoformat(),
+        'readings': {name: value for name, value, _ in readings},
+        'statuses': agent_statuses,
+    }
+    latest_statuses = dict(statuses)
+    changed_types = (LIFE_RESIDENT_TYPES if 1 in latest_statuses else ()) + \
+        (ECO_RESIDENT_TYPES if 2 in latest_statuses else ())
+    if changed_types:
+        type_statuses = get_type_statuses(latest_statuses)
+        delta['residents'] = {resident_type: dict(zip(('status', 'status_class', 'emoji'), type_statuses[resident_type]))
+                              for resident_type in changed_types}
+    LIVE.publish('cycle', delta)
 
 def agent_validator(input,trigger):
     validated_output = ""
     return validated_output
 
-def get_database_schema():
-    engine = create_engine('sqlite:///db/db.db')
-    inspector = inspect(engine)    
-    schema_info = "Схема базы данных:\n"
-    
-    tables = inspector.get_table_names()
-    
-    for table in tables:
-        schema_info += f"\nТаблица: {table}\n"
-        columns = inspector.get_columns(table)
-        for column in columns:
-            schema_info += f"  - {column['name']} ({column['type']})"
+def get_sql_engine():
+    # The Flask-SQLAlchemy engine, so ad-hoc queries share its pool and pragmas
+    return sqlitedb.engine
+
+# Schema text and NL->SQL prompt prefix, rebuilt only when PRAGMA schema_version changes
+SCHEMA_CACHE = {'version': None, 'schema': None, 'prefix': None}
+SCHEMA_CACHE_LOCK = Lock()
+DDL_STATEMENTS = ('CREATE', 'ALTER', 'DROP')
+
+def invalidate_schema_cache():
+    with SCHEMA_CACHE_LOCK:
+        SCHEMA_CACHE['version'] = None
+
+def build_database_schema(inspector):
+    schema_info = ["Схема базы данных:\n"]
+
+    for table in inspector.get_table_names():
+        schema_info.append(f"\nТаблица: {table}\n")
+        for column in inspector.get_columns(table):
+            line = f"  - {column['name']} ({column['type']})"
             if column.get('primary_key'):
-                schema_info += " PRIMARY KEY"
+                line += " PRIMARY KEY"
             if column.get('nullable') is False:
-                schema_info += " NOT NULL"
-            schema_info += "\n"
-        
+                line += " NOT NULL"
+            schema_info.append(line + "\n")
+
         foreign_keys = inspector.get_foreign_keys(table)
         if foreign_keys:
-            schema_info += "  Внешние ключи:\n"
+            schema_info.append("  Внешние ключи:\n")
             for fk in foreign_keys:
-                schema_info += f"    - {fk['constrained_columns']} -> {fk['referred_table']}.{fk['referred_columns']}\n"
-    
-    return schema_info
+                schema_info.append(f"    - {fk['constrained_columns']} -> {fk['referred_table']}.{fk['referred_columns']}\n")
 
-def execute_sql_query(sql_query):
-    engine = create_engine('sqlite:///db/db.db')
-    
-    try:
-        with engine.connect() as conn:
-            if sql_query.strip().upper().startswith('SELECT'):
-                result = conn.execute(str(sql_query))
-                df = pd.DataFrame(result.fetchall(), columns=result.keys())
-                return df.to_string(index=False)
-            else:
-                result = conn.execute(str(sql_query))
-                conn.commit()
-                return f"Запрос выполнен успешно. Затронуто строк: {result.rowcount}"
-                
-    except Exception as e:
-        return f"Ошибка выполнения запроса: {str(e)}"
-    
-def natural_language_to_sql(user_query, agent_id=5):
-    schema_info = get_database_schema()
-    
-    prompt = f"""
+    return "".join(schema_info)
+
+def get_schema_context():
+    with get_sql_engine().connect() as conn:
+        version = conn.exec_driver_sql("PRAGMA schema_version").scalar()
+        with SCHEMA_CACHE_LOCK:
+            if SCHEMA_CACHE['version'] == version:
+                return version, SCHEMA_CACHE['schema'], SCHEMA_CACHE['prefix']
+        schema_info = build_database_schema(inspect(conn))
+
+    prefix = f"""
         {schema_info}
 
         Преобразуй следующий запрос на естественном языке в ОДИН корректный SQL запрос.
 
-        Пользовательский запрос: "{user_query}"
+        Пользовательский запрос: \""""
+    with SCHEMA_CACHE_LOCK:
+        SCHEMA_CACHE.update(version=version, schema=schema_info, prefix=prefix)
+    logger.info(f"Database schema cached, schema_version={version}")
+    return version, schema_info, prefix
+
+def get_database_schema():
+    return get_schema_context()[1]
+
+# Generated SQL per (schema version, normalized question), kept across restarts
+SQL_TRANSLATIONS = PersistentCache(os.environ.get('SQL_TRANSLATION_CACHE', 'db/sql_translations.json'),
+                                   maxsize=int(os.environ.get('SQL_TRANSLATION_CACHE_SIZE', '512')))
+RUSSIAN_ENDINGS = ('ами', 'ями', 'ать', 'ять', 'ить', 'еть', 'ия', 'ие', 'ии', 'ию', 'ее', 'ой', 'ей', 'ый',
+                   'ий', 'ая', 'ое', 'ые', 'ую', 'ых', 'их', 'ым', 'им', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем',
+                   'ов', 'ев', 'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь', 'й')
+
+def stem_keyword(keyword):
+    for ending in RUSSIAN_ENDINGS:
+        if keyword.endswith(ending) and len(keyword) - len(ending) >= 4:
+            return keyword[:-len(ending)]
+    return keyword
+
+# Longest stems first so "пользовател" wins over shorter ones
+KEYWORD_STEMS = sorted(
+    ((stem_keyword(keyword), keyword) for keyword in DB_KEYWORDS if re.search('[а-я]', keyword)),
+    key=lambda item: -len(item[0]))
+
+def normalize_question(question):
+    words = []
+    for word in re.findall(r'\w+', question.lower().replace('ё', 'е')):
+        for stem, keyword in KEYWORD_STEMS:
+            # Only inflected forms of a keyword, not longer words that start with it
+            if word.startswith(stem) and (len(word) == len(stem) or word[len(stem):] in RUSSIAN_ENDINGS):
+                word = keyword
+                break
+        words.append(word)
+    return " ".join(words)
+
+RESIDENT_COUNT_QUERIES = {
+    (): text("SELECT COUNT(*) AS residents FROM residents"),
+    ('type',): text("SELECT type, COUNT(*) AS residents FROM residents GROUP BY type ORDER BY type"),
+    ('room',): text("SELECT room, COUNT(*) AS residents FROM residents GROUP BY room ORDER BY room"),
+    ('type', 'room'): text("SELECT type, room, COUNT(*) AS residents FROM residents "
+                           "GROUP BY type, room ORDER BY type, room"),
+}
+
+def answer_analytics(user_query):
+    # Well-known analytic questions are answered without the LLM;
+    # None means the question has to go through natural_language_to_sql
+    intent = match_intent(user_query)
+    if intent is None:
+        return None
+    logger.info(f"Analytics intent {intent.kind} for query: {user_query}, params: {intent.params}")
+
+    if intent.kind == INTENT_SENSOR_STATS:
+        db = DatabaseManager()
+        end = datetime.now()
+        start = end - intent.params['window']
+        lines = []
+        for sensor in intent.params['sensors']:
+            if intent.params['percentiles']:
+                # Percentiles need the raw readings
+                summary = summarize_values(db.get_sensor_values(sensor, start, end), intent.params['percentiles'])
+            else:
+                summary = db.get_sensor_stats(sensor, start, end) or {'count': 0}
+                summary = {key: float(value) if key != 'count' and value is not None else value
+                           for key, value in summary.items()}
+            lines.append(format_sensor_stats(sensor, intent.params['window'], intent.params['aggregates'], summary))
+        return "\n".join(lines)
+
+    if intent.kind == INTENT_RESIDENT_COUNTS:
+        with get_sql_engine().connect() as conn:
+            result = conn.execute(RESIDENT_COUNT_QUERIES[tuple(intent.params['group_by'])])
+            rows = result.fetchall()
+            return format_rows(list(result.keys()), rows) if rows else format_rows(['residents'], [(0,)])
+
+    if intent.kind == INTENT_AGENT_STATUSES:
+        statuses = DatabaseManager().get_latest_statuses()
+        rows = [(role, statuses.get(agent_id, 'unknown')) for agent_id, role in AGENT_ROLES.items()]
+        return format_rows(['agent', 'status'], rows)
+
+def natural_language_to_sql(user_query, agent_id=5):
+    schema_version, _, prompt_prefix = get_schema_context()
+    cache_key = f"{schema_version}:{normalize_question(user_query)}"
+    cached_sql = SQL_TRANSLATIONS.get(cache_key)
+    if cached_sql is not None:
+        logger.info(f"Cached SQL for query: {user_query}, SQL: {cached_sql}")
+        return execute_sql_query(cached_sql)
+
+    prompt = prompt_prefix + f"""{user_query}"
 
         ВАЖНЫЕ ИНСТРУКЦИИ:
         1. Верни ТОЛЬКО ОДИН SQL запрос без каких-либо объяснений
@@ -933,9 +1397,10 @@ def natural_language_to_sql(user_query, agent_id=5):
         SQL запрос:
         """
     
-    response = model_chat(prompt, agent_id)
+    future = model_chat_async(prompt, agent_id, lane=LANE_INTERACTIVE, timeout=CHAT_TIMEOUT)
     
     try:
+        response = future.result(timeout=CHAT_TIMEOUT)
         response_data = json.loads(response)
         sql_query = response_data['choices'][0]['message']['content'].strip()
         
@@ -956,70 +1421,157 @@ def natural_language_to_sql(user_query, agent_id=5):
             sql_query = queries[0] if queries else sql_query
         
         result = execute_sql_query(sql_query)
+        if not result.startswith("Ошибка"):
+            SQL_TRANSLATIONS.set(cache_key, sql_query)
         return result
         
+    except concurrent.futures.TimeoutError:
+        logger.warning(f"SQL translation timeout for query: {user_query}")
+        return "Ошибка: время ожидания ответа модели истекло"
     except Exception as e:
         logger.error(f"Error processing query: {e}")
         return f"Ошибка при обработке запроса: {str(e)}"
 
+SQL_RESULT_MAX_ROWS = int(os.environ.get('SQL_RESULT_MAX_ROWS', '200'))
+SQL_RESULT_MAX_BYTES = int(os.environ.get('SQL_RESULT_MAX_BYTES', '65536'))
+SQL_FETCH_SIZE = 50
+
+def format_table(columns, rows):
+    # Right-aligned plain text table, same layout as DataFrame.to_string(index=False)
+    cells = [[str(value) for value in row] for row in rows]
+    widths = [len(str(column)) for column in columns]
+    for row in cells:
+        for i, value in enumerate(row):
+            widths[i] = max(widths[i], len(value))
+    lines = [" ".join(str(column).rjust(width) for column, width in zip(columns, widths))]
+    lines.extend(" ".join(value.rjust(width) for value, width in zip(row, widths)) for row in cells)
+    return "\n".join(lines)
+
+def fetch_limited(result, max_rows, max_bytes):
+    # Reads rows in small batches and stops at the row or byte budget,
+    # so the size of the table does not matter
+    rows = []
+    size = 0
+    while len(rows) < max_rows and size < max_bytes:
+        batch = result.fetchmany(min(SQL_FETCH_SIZE, max_rows - len(rows)))
+        if not batch:
+            return rows, False
+        for i, row in enumerate(batch, 1):
+            size += sum(len(str(value)) + 1 for value in row)
+            rows.append(row)
+            if size >= max_bytes:
+                # Rows left over in this batch were read but are not shown
+                if i < len(batch):
+                    return rows, True
+                break
+    return rows, result.fetchone() is not None
+
 def execute_sql_query(sql_query):
-    engine = create_engine('sqlite:///db/db.db')
-    
     try:
-        with engine.connect() as conn:
+        with get_sql_engine().connect() as conn:
             if sql_query.strip().upper().startswith('SELECT'):
-                result = conn.execute(str(sql_query))
-                df = pd.DataFrame(result.fetchall(), columns=result.keys())
-                if df.empty:
+                result = conn.execution_options(stream_results=True).execute(str(sql_query))
+                try:
+                    rows, truncated = fetch_limited(result, SQL_RESULT_MAX_ROWS, SQL_RESULT_MAX_BYTES)
+                    columns = list(result.keys())
+                finally:
+                    result.close()
+                if not rows:
                     return "Данные не найдены"
-                return df.to_string(index=False)
+                table = format_table(columns, rows)
+                if truncated:
+                    table += (f"\n... Результат обрезан: показаны первые {len(rows)} строк "
+                              f"(лимит {SQL_RESULT_MAX_ROWS} строк / {SQL_RESULT_MAX_BYTES} байт)")
+                return table
             else:
-                with conn.begin() as transaction:
-                    result = conn.execute(str(sql_query))
-                    return f"Запрос выполнен успешно. Затронуто строк: {result.rowcount}"
+                rowcount = SQLITE_WRITER.run(
+                    lambda session: session.connection().exec_driver_sql(str(sql_query)).rowcount)
+                if sql_query.strip().upper().startswith(DDL_STATEMENTS):
+                    invalidate_schema_cache()
+                # Raw statements skip the ORM events that keep cached users fresh
+                USER_CACHE.clear()
+                return f"Запрос выполнен успешно. Затронуто строк: {rowcount}"
                 
     except Exception as e:
         return f"Ошибка выполнения запроса: {str(e)}"
 
+def maintain_timeseries():
+    DatabaseManager().maintain_timeseries()
+
 def start_periodic_tasks():
+    if SCHEDULER.running:
+        logger.info("Periodic tasks are already running")
+        return
     try:
-        periodic_thread = threading.Thread(target=my_function, daemon=True)
-        periodic_thread.start()
+        SCHEDULER.add_job("agents-cycle", my_function, AGENT_CYCLE_INTERVAL,
+                          mode=FIXED_RATE, jitter=AGENT_CYCLE_JITTER, missed_runs=MISSED_SKIP)
+        SCHEDULER.add_job("timeseries-maintenance", maintain_timeseries, TIMESERIES_MAINTENANCE_INTERVAL,
+                          mode=FIXED_DELAY, start_delay=60)
+        SCHEDULER.start()
         logger.info("Periodic tasks started successfully in background thread")
     except Exception as e:
         logger.error(f"Error starting periodic tasks: {e}")
 
+@app.route('/api/scheduler')
+@login_required
+def scheduler_stats():
+    return jsonify(SCHEDULER.stats())
+
+@app.route('/api/llm')
+@login_required
+def llm_stats():
+    return jsonify(LLM_DISPATCHER.stats())
+
+@app.route('/api/cache')
+@login_required
+def cache_stats():
+    return jsonify({
+        'agents': AGENT_CACHE.stats(),
+        'sql_translations': SQL_TRANSLATIONS.stats(),
+        'model_chat_coalescing': MODEL_CHAT_FLIGHTS.stats(),
+        'settings': SETTINGS.stats(),
+        'agent_prompts': AGENTS.stats(),
+        'users': USER_CACHE.stats(),
+    })
+
+@app.route('/api/sqlite')
+@login_required
+def sqlite_stats():
+    return jsonify({'writer': SQLITE_WRITER.stats(), 'pool': sqlitedb.engine.pool.status()})
+
+@app.route('/api/live/stats')
+@login_required
+def live_stats():
+    return jsonify(LIVE.stats())
+
 
 
 @atexit.register
-def shutdown_thread_pool():
-    THREAD_POOL.shutdown(wait=False)
-    logger.info("Thread pool shutdown")
+def shutdown_llm_dispatcher():
+    LLM_DISPATCHER.shutdown()
+    logger.info("LLM dispatcher shutdown")
 
 if __name__ == '__main__':
-    from models import DatabaseManager
+    from models import DatabaseManager, init_database
     from connector import *
+    db_manager = init_database()
+    atexit.register(db_manager.close)
     with app.app_context():
         sqlitedb.create_all()
-        try:
-                if not User.query.filter_by(username='admin1').first():
-                    admin1 = User(username='admin1', role='admin')
-                    admin1.set_password('admin123')
-                    sqlitedb.session.add(admin1)
-                    logger.info("User 'admin1' added to sqlite.")
+        ensure_indexes()
+
+        def create_admins(session):
+            for username in ('admin1', 'admin2'):
+                if not session.query(User).filter_by(username=username).first():
+                    admin = User(username=username, role='admin')
+                    admin.set_password('admin123')
+                    session.add(admin)
+                    logger.info(f"User '{username}' added to sqlite.")
                 else:
-                    logger.info("User 'admin1' already exists")
-
-                if not User.query.filter_by(username='admin2').first():
-                    admin2 = User(username='admin2', role='admin')
-                    admin2.set_password('admin123')
-                    sqlitedb.session.add(admin2)
-                    logger.info("User 'admin2' added to sqlite.")
-                else:
-                    logger.info("User 'admin2' already exists")
-
-                sqlitedb.session.commit()
+                    logger.info(f"User '{username}' already exists")
 
+        try:
+            SQLITE_WRITER.run(create_admins)
         except Exception as e:
             logger.error(f"Error on creating user 'admin' in sqlite: {e}")
         try:
@@ -1027,11 +1579,16 @@ if __name__ == '__main__':
             Settings.save_setting('validate_requests', GLOBALS.VALIDATION_ENABLED)
         except Exception as e:
             logger.error(f"Error in adding validate_requests in sqlite: {e}")
-        
-        my_function()
 
-        background_thread = threading.Thread(target=start_periodic_tasks, daemon=True)
-        background_thread.start()
-        logger.info("Background thread for periodic tasks started")
+    # The debug reloader runs this block in a watcher process too; only the
+    # serving child process may own the scheduler
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_periodic_tasks()
+        atexit.register(SCHEDULER.stop, 5)
+        # Other processes announce settings and prompt changes here
+        config_listener = NotificationListener(CONFIG_CHANNEL, handle_config_notification)
+        config_listener.start()
+        atexit.register(config_listener.stop)
+        atexit.register(SETTINGS_WRITER.flush)
 
     app.run(host='0.0.0.0', port=5500, debug=True)
\ No newline at end of file
@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Postgres NOTIFY channel other processes listen on to drop their copies
+CONFIG_CHANNEL = 'smarthome_config'
+ORIGIN = f"{socket.gethostname()}:{os.getpid()}"
+
+class VersionedCache:
+    # Values loaded once and served from memory until invalidated. The
+    # version moves on every change, so a load that raced with an
+    # invalidation is returned but not kept.
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._values = {}
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                return self._values[key]
+            self.misses += 1
+            version = self.version
+        value = loader()
+        with self._lock:
+            if self.version == version:
+                self._values[key] = value
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+            self.version += 1
+
+    def invalidate(self, keys=None):
+        with self._lock:
+            if keys is None:
+                self._values.clear()
+            else:
+                for key in keys:
+                    self._values.pop(key, None)
+            self.version += 1
+
+    def stats(self):
+        with self._lock:
+            return {'version': self.version, 'size': len(self._values), 'hits': self.hits, 'misses': self.misses}
+
+class WriteBehind:
+    # Collects writes per key and hands them to flush() as one batch shortly
+    # after the first one arrives; later writes to a key replace earlier ones
+    def __init__(self, name, flush, delay=0.5):
+        self.name = name
+        self._flush = flush
+        self.delay = delay
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._thread = None
+        self.writes = 0
+        self.flushes = 0
+
+    def write(self, key, value):
+        with self._condition:
+            self._pending[key] = value
+            self.writes += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+            time.sleep(self.delay)
+            self.flush()
+
+    def flush(self):
+        with self._condition:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        try:
+            self._flush(batch)
+            self.flushes += 1
+        except Exception as e:
+            logger.error(f"Error flushing {self.name} writes {list(batch)}: {e}")
+
+    def stats(self):
+        with self._condition:
+            return {'pending': len(self._pending), 'writes': self.writes, 'flushes': self.flushes}
+
+SETTINGS = VersionedCache('settings')
+AGENTS = VersionedCache('agents')
+
+def notification_payload(kind, keys=None):
+    return json.dumps({'origin': ORIGIN, 'kind': kind, 'keys': keys})
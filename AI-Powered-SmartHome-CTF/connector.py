@@ -1,6 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import tuple_, event, inspect
+from sqlalchemy.orm import Session, object_session
 from app import sqlitedb, UserMixin, secrets, hashlib
+import os
 from datetime import datetime
+from dashboard import DASHBOARD
+from cache import TTLCache
+from sqlite_writer import SQLiteWriter
+from config_cache import SETTINGS, WriteBehind, CONFIG_CHANNEL, notification_payload
+from models import DatabaseManager
 
 class Changes(sqlitedb.Model):
     change_id = sqlitedb.Column(sqlitedb.Integer, primary_key=True)
@@ -15,13 +23,18 @@ class Changes(sqlitedb.Model):
 
     @staticmethod
     def save_changes(agent_name, old_text, new_text, validated, user_id):
-        changes = Changes.query.filter_by(old_text=old_text).first()
-        if changes is None:
-            changes = Changes(agent_name=agent_name, old_text=old_text, new_text = new_text, validated = validated, user_id = user_id)
-            sqlitedb.session.add(changes)
-        else:
-            changes.user_id = user_id
-        sqlitedb.session.commit()
+        def save(session):
+            changes = session.query(Changes).filter_by(old_text=old_text).first()
+            if changes is None:
+                changes = Changes(agent_name=agent_name, old_text=old_text, new_text = new_text, validated = validated, user_id = user_id)
+                session.add(changes)
+            else:
+                changes.user_id = user_id
+        SQLITE_WRITER.run(save)
+
+    @staticmethod
+    def delete_change(change_id):
+        SQLITE_WRITER.run(lambda session: session.query(Changes).filter_by(change_id=change_id).delete())
 
 class User(UserMixin, sqlitedb.Model):
     id = sqlitedb.Column(sqlitedb.Integer, primary_key=True)
@@ -42,6 +55,40 @@ class User(UserMixin, sqlitedb.Model):
         pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), 100000)
         return pwd_hash.hex() == stored_hash
 
+    @staticmethod
+    def get_cached(user_id):
+        # Detached copies keyed by id, shared by every request thread as read-only objects
+        user = USER_CACHE.get(user_id)
+        if user is None:
+            user = User.query.filter_by(id=user_id).first()
+            if user is None:
+                return None
+            sqlitedb.session.expunge(user)
+            USER_CACHE.set(user_id, user)
+        return user
+
+USER_CACHE = TTLCache(maxsize=int(os.environ.get('USER_CACHE_SIZE', '1024')),
+                      ttl=int(os.environ.get('USER_CACHE_TTL', '300')))
+
+@event.listens_for(User, 'after_update')
+def user_updated(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.role.history.has_changes() or state.attrs.password_hash.history.has_changes():
+        USER_CACHE.pop(target.id)
+        # Dropped again on commit, a request may have cached the old row in between
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('stale_users', set()).add(target.id)
+
+@event.listens_for(User, 'after_delete')
+def user_deleted(mapper, connection, target):
+    USER_CACHE.pop(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def drop_stale_users(session):
+    for user_id in session.info.pop('stale_users', ()):
+        USER_CACHE.pop(user_id)
+
 class Settings(sqlitedb.Model):
     id = sqlitedb.Column(sqlitedb.Integer, primary_key=True)
     key = sqlitedb.Column(sqlitedb.String(100), unique=True, nullable=False)
@@ -49,18 +96,43 @@ class Settings(sqlitedb.Model):
 
     @staticmethod
     def get_setting(key):
+        return SETTINGS.get(key, lambda: Settings.load_setting(key))
+
+    @staticmethod
+    def load_setting(key):
         setting = Settings.query.filter_by(key=key).first()
         return setting.value if setting else None
 
     @staticmethod
     def save_setting(key, value):
-        setting = Settings.query.filter_by(key=key).first()
-        if setting is None:
-            setting = Settings(key=key, value=value)
-            sqlitedb.session.add(setting)
-        else:
-            setting.value = value
-        sqlitedb.session.commit()
+        # Same text SQLite hands back for the value
+        if isinstance(value, bool):
+            value = '1' if value else '0'
+        elif value is not None:
+            value = str(value)
+        if Settings.get_setting(key) == value:
+            return
+        SETTINGS.set(key, value)
+        SETTINGS_WRITER.write(key, value)
+
+    @staticmethod
+    def write_settings(batch):
+        def save(session):
+            for key, value in batch.items():
+                setting = session.query(Settings).filter_by(key=key).first()
+                if setting is None:
+                    session.add(Settings(key=key, value=value))
+                else:
+                    setting.value = value
+        try:
+            SQLITE_WRITER.run(save)
+        except Exception:
+            # Reads go back to the database instead of the unsaved values
+            SETTINGS.invalidate(list(batch))
+            raise
+        DatabaseManager().notify(CONFIG_CHANNEL, notification_payload('settings', list(batch)))
+
+SETTINGS_WRITER = WriteBehind('settings', Settings.write_settings)
 
 class Residents(sqlitedb.Model):
     resident_id = sqlitedb.Column(sqlitedb.Integer, primary_key=True)
@@ -69,9 +141,43 @@ class Residents(sqlitedb.Model):
     room = sqlitedb.Column(sqlitedb.String(50), nullable=False)
     voucher = sqlitedb.Column(sqlitedb.String(50), nullable=False)
 
+    # (name, room) also serves the duplicate check in save_resident,
+    # (room, type) the per-group counts on the dashboard
+    __table_args__ = (
+        sqlitedb.Index('ix_residents_room', room),
+        sqlitedb.Index('ix_residents_type', type),
+        sqlitedb.Index('ix_residents_name_room', name, room),
+        sqlitedb.Index('ix_residents_room_type', room, type),
+    )
+
     @staticmethod
     def get_all_residents():
         return Residents.query.all()
+
+    @staticmethod
+    def get_residents_page(page=1, per_page=50, search=None, room=None, resident_type=None):
+        query = Residents.query
+        if room:
+            query = query.filter(Residents.room == room)
+        if resident_type:
+            query = query.filter(Residents.type == resident_type)
+        if search:
+            query = query.filter(Residents.name.contains(search, autoescape=True))
+        query = query.order_by(Residents.room, Residents.name, Residents.resident_id)
+        return query.paginate(page=page, per_page=per_page, error_out=False)
+
+    @staticmethod
+    def get_room_counts():
+        return dict(sqlitedb.session.query(Residents.room, sqlitedb.func.count()).group_by(Residents.room).all())
+
+    @staticmethod
+    def get_type_room_counts():
+        # [(type, room, count)] read in order off the (room, type) index;
+        # count(*) so the rows themselves are never touched
+        rows = sqlitedb.session.query(Residents.type, Residents.room, sqlitedb.func.count()) \
+            .group_by(Residents.room, Residents.type) \
+            .order_by(Residents.room, Residents.type).all()
+        return [tuple(row) for row in rows]
     
     @staticmethod
     def get_residents_by_room(room):
@@ -79,18 +185,21 @@ class Residents(sqlitedb.Model):
     
     @staticmethod
     def save_resident(name, resident_type, room, voucher):
-        resident = Residents.query.filter_by(name=name, room=room).first()
-        
-        if resident is None:
-            resident = Residents(
-                name=name,
-                type=resident_type,
-                room=room,
-                voucher = voucher
-            )
-            sqlitedb.session.add(resident)
-        
-        sqlitedb.session.commit()
+        def save(session):
+            resident = session.query(Residents).filter_by(name=name, room=room).first()
+
+            if resident is None:
+                resident = Residents(
+                    name=name,
+                    type=resident_type,
+                    room=room,
+                    voucher = voucher
+                )
+                session.add(resident)
+            return resident
+
+        resident = SQLITE_WRITER.run(save)
+        DASHBOARD.invalidate()
         return resident
     
 class ChatHistory(sqlitedb.Model):
@@ -102,6 +211,11 @@ class ChatHistory(sqlitedb.Model):
     timestamp = sqlitedb.Column(sqlitedb.DateTime, default=datetime.utcnow)
     
     user = sqlitedb.relationship('User', back_populates='chat_history')
+
+    # Keyset pagination walks this index newest first
+    __table_args__ = (
+        sqlitedb.Index('ix_chat_history_user_timestamp_id', user_id, timestamp.desc(), id.desc()),
+    )
     
     @staticmethod
     def save_chat_message(user_id, message, response, message_type='ai_chat'):
@@ -111,8 +225,7 @@ class ChatHistory(sqlitedb.Model):
             response=response,
             message_type=message_type
         )
-        sqlitedb.session.add(chat_entry)
-        sqlitedb.session.commit()
+        SQLITE_WRITER.run(lambda session: session.add(chat_entry))
         return chat_entry
     
     @staticmethod
@@ -122,6 +235,18 @@ class ChatHistory(sqlitedb.Model):
                                .limit(limit)\
                                .all()
     
+    @staticmethod
+    def get_chat_page(user_id, before=None, limit=20):
+        # before is the (timestamp, id) of the oldest message already shown
+        query = ChatHistory.query.filter_by(user_id=user_id)
+        if before is not None:
+            query = query.filter(tuple_(ChatHistory.timestamp, ChatHistory.id) < tuple(before))
+        rows = query.order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc())\
+                    .limit(limit + 1)\
+                    .all()
+        next_before = (rows[limit - 1].timestamp, rows[limit - 1].id) if len(rows) > limit else None
+        return rows[:limit], next_before
+
     @staticmethod
     def get_recent_chat_history(user_id, limit=10):
         return ChatHistory.query.filter_by(user_id=user_id)\
@@ -131,8 +256,7 @@ class ChatHistory(sqlitedb.Model):
     
     @staticmethod
     def clear_user_history(user_id):
-        ChatHistory.query.filter_by(user_id=user_id).delete()
-        sqlitedb.session.commit()
+        SQLITE_WRITER.run(lambda session: session.query(ChatHistory).filter_by(user_id=user_id).delete())
     
     @staticmethod
     def get_all_chat_stats():
@@ -140,4 +264,14 @@ class ChatHistory(sqlitedb.Model):
         return sqlitedb.session.query(
             ChatHistory.message_type,
             func.count(ChatHistory.id).label('count')
-        ).group_by(ChatHistory.message_type).all()
\ No newline at end of file
+        ).group_by(ChatHistory.message_type).all()
+
+# Every write to the SQLite database goes through this thread
+SQLITE_WRITER = SQLiteWriter('sqlite-writer', lambda: sqlitedb.engine)
+
+def ensure_indexes():
+    # create_all() skips tables that already exist, so indexes added to
+    # existing models are created here
+    for table in sqlitedb.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=sqlitedb.engine, checkfirst=True)
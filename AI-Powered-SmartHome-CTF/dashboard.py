@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+DashboardSnapshot = namedtuple('DashboardSnapshot', ['version', 'created_at', 'data'])
+
+def freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+class DashboardStore:
+    # Holds the last rendered dashboard data. Writers invalidate it, the
+    # periodic cycle republishes it and page handlers only read it.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._snapshot = None
+        self._version = 0
+
+    @property
+    def version(self):
+        with self._lock:
+            return self._version
+
+    def current(self):
+        return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._snapshot = None
+
+    def publish(self, data, based_on=None):
+        with self._lock:
+            if based_on is None:
+                self._version += 1
+            snapshot = DashboardSnapshot(self._version, time.time(), freeze(data))
+            # Data built before a concurrent write is served once but not kept
+            if based_on is None or based_on == self._version:
+                self._snapshot = snapshot
+            return snapshot
+
+    def refresh(self, builder):
+        with self._build_lock:
+            based_on = self.version
+            return self.publish(builder(), based_on=based_on)
+
+    def get_or_build(self, builder):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._build_lock:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                return snapshot
+            based_on = self.version
+            return self.publish(builder(), based_on=based_on)
+
+DASHBOARD = DashboardStore()
@@ -0,0 +1,142 @@
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LANE_INTERACTIVE = 'interactive'
+LANE_PERIODIC = 'periodic'
+LANE_VALIDATION = 'validation'
+
+class DispatcherFull(Exception):
+    def __init__(self, lane, retry_after):
+        super().__init__(f"Lane '{lane}' is full, retry after {retry_after} sec")
+        self.lane = lane
+        self.retry_after = retry_after
+
+class DeadlineExceeded(Exception):
+    pass
+
+class Lane:
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.condition = threading.Condition()
+        self.queue = []
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.avg_duration = None
+
+    def stats(self):
+        with self.condition:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'queued': len(self.queue),
+                'running': self.running,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'expired': self.expired,
+                'avg_duration': self.avg_duration,
+            }
+
+class Dispatcher:
+    # Every lane has its own worker threads and bounded priority queue, so a
+    # lane full of slow calls cannot starve the others. Submitting to a full
+    # lane fails right away, queued work whose deadline passed is dropped.
+    def __init__(self, name, lanes):
+        self.name = name
+        self._lanes = {}
+        self._sequence = itertools.count()
+        self._stopping = False
+        for lane_name, (workers, max_queue) in lanes.items():
+            lane = Lane(lane_name, workers, max_queue)
+            self._lanes[lane_name] = lane
+            for i in range(workers):
+                threading.Thread(target=self._work, args=(lane,), name=f"{name}-{lane_name}-{i}",
+                                 daemon=True).start()
+
+    def submit(self, lane_name, func, *args, priority=0, timeout=None):
+        # Higher priority runs first; timeout is how long the call may wait in the queue
+        lane = self._lanes[lane_name]
+        future = concurrent.futures.Future()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with lane.condition:
+            if self._stopping:
+                raise RuntimeError(f"Dispatcher {self.name} is shut down")
+            if len(lane.queue) >= lane.max_queue:
+                lane.rejected += 1
+                raise DispatcherFull(lane.name, self._retry_after(lane))
+            heapq.heappush(lane.queue, (-priority, next(self._sequence), deadline, future, func, args))
+            lane.submitted += 1
+            lane.condition.notify()
+        return future
+
+    def _retry_after(self, lane):
+        per_call = lane.avg_duration or 1.0
+        return max(1, min(60, math.ceil(per_call * (len(lane.queue) + lane.running) / lane.workers)))
+
+    def _work(self, lane):
+        while True:
+            with lane.condition:
+                while not lane.queue and not self._stopping:
+                    lane.condition.wait()
+                if self._stopping:
+                    return
+                _, _, deadline, future, func, args = heapq.heappop(lane.queue)
+                expired = deadline is not None and time.monotonic() > deadline
+                if expired:
+                    lane.expired += 1
+                else:
+                    lane.running += 1
+
+            # Futures are completed outside the lane lock, their callbacks may take other locks
+            if expired:
+                logger.warning(f"Dropped stale call in lane {lane.name}, deadline passed while queued")
+                future.set_exception(DeadlineExceeded(f"Deadline passed while queued in lane {lane.name}"))
+                continue
+            if not future.set_running_or_notify_cancel():
+                with lane.condition:
+                    lane.running -= 1
+                continue
+
+            started = time.monotonic()
+            failed = False
+            try:
+                result = func(*args)
+            except BaseException as e:
+                failed = True
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            duration = time.monotonic() - started
+
+            with lane.condition:
+                lane.running -= 1
+                lane.completed += 1
+                lane.failed += failed
+                lane.avg_duration = duration if lane.avg_duration is None \
+                    else 0.8 * lane.avg_duration + 0.2 * duration
+
+    def shutdown(self):
+        self._stopping = True
+        for lane in self._lanes.values():
+            with lane.condition:
+                queued, lane.queue = lane.queue, []
+                lane.condition.notify_all()
+            for item in queued:
+                item[3].cancel()
+
+    def stats(self):
+        return {name: lane.stats() for name, lane in self._lanes.items()}
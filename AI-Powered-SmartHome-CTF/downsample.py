@@ -0,0 +1,34 @@
+import numpy as np
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last points and
+    # from every bucket in between the one forming the largest triangle with
+    # the previously kept point and the average of the next bucket.
+    # Returns the indices of the kept points.
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    size = x.size
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+
+    # Bucket boundaries over the points between the first and the last one
+    edges = np.linspace(1, size - 1, threshold - 1).astype(int)
+    kept = np.empty(threshold, dtype=int)
+    kept[0] = 0
+    kept[-1] = size - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        else:
+            next_start, next_end = size - 1, size
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(areas.argmax())
+        kept[bucket + 1] = previous
+    return kept
@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return prefix + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class Subscriber:
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize)
+        self.closed = False
+
+    def get(self, timeout):
+        # Next encoded event, or None when nothing arrived within timeout
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class LiveHub:
+    # Publishers only enqueue; one thread encodes every event once and hands
+    # the same text to all subscribers. A subscriber that falls too far
+    # behind is dropped, its client reconnects and starts from fresh data.
+    def __init__(self, name='live', max_subscribers=100, backlog=100):
+        self.name = name
+        self.max_subscribers = max_subscribers
+        self.backlog = backlog
+        self._events = queue.Queue(backlog)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped_events = 0
+        self.dropped_subscribers = 0
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-publisher", daemon=True)
+                self._thread.start()
+
+    def subscribe(self):
+        # None when the hub already serves max_subscribers clients
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscriber = Subscriber(self.backlog)
+            self._subscribers.add(subscriber)
+        self._ensure_thread()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.closed = True
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        with self._lock:
+            if not self._subscribers:
+                return
+        self._ensure_thread()
+        try:
+            self._events.put_nowait(sse_event(data, event))
+            self.published += 1
+        except queue.Full:
+            self.dropped_events += 1
+            logger.warning(f"Dropped {event} event, {self.name} publisher is behind")
+
+    def _run(self):
+        while True:
+            message = self._events.get()
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscriber in subscribers:
+                try:
+                    subscriber.queue.put_nowait(message)
+                    self.delivered += 1
+                except queue.Full:
+                    self.dropped_subscribers += 1
+                    self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            subscribers = len(self._subscribers)
+        return {
+            'subscribers': subscribers,
+            'max_subscribers': self.max_subscribers,
+            'pending': self._events.qsize(),
+            'published': self.published,
+            'delivered': self.delivered,
+            'dropped_events': self.dropped_events,
+            'dropped_subscribers': self.dropped_subscribers,
+        }
+
+LIVE = LiveHub('live', int(os.environ.get('LIVE_MAX_CLIENTS', '100')))
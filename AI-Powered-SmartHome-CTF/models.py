@@ -1,59 +1,180 @@
 import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import RealDictCursor
+from psycopg2 import sql, pool, extensions
+from psycopg2.extras import RealDictCursor, execute_values, Json
 import os
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 import logging
+import json
+import re
+import select
+import threading
 import time
+from dashboard import DASHBOARD
+from rules import DEFAULT_RULES
+from config_cache import AGENTS, SETTINGS, CONFIG_CHANNEL, ORIGIN, notification_payload
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+POOL_MIN_SIZE = int(os.environ.get('POSTGRES_POOL_MIN', '4'))
+POOL_MAX_SIZE = int(os.environ.get('POSTGRES_POOL_MAX', '10'))
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get('POSTGRES_POOL_TIMEOUT', '10'))
+POOL_PING_AFTER = float(os.environ.get('POSTGRES_POOL_PING_AFTER', '30'))
+
+SENSOR_RETENTION_DAYS = int(os.environ.get('SENSOR_RETENTION_DAYS', '90'))
+STATUS_RETENTION_DAYS = int(os.environ.get('STATUS_RETENTION_DAYS', '90'))
+ROLLUP_MINUTE_RETENTION_DAYS = int(os.environ.get('ROLLUP_MINUTE_RETENTION_DAYS', '30'))
+PARTITION_MONTHS_AHEAD = 2
+INSERT_PAGE_SIZE = 1000
+RAW_SERIES_WINDOW = timedelta(hours=6)
+MINUTE_ROLLUP_WINDOW = timedelta(days=7)
+
+# Called with the agent id after its prompt has been changed
+AGENT_UPDATE_HOOKS = []
+
+TIMESERIES_TABLES = {
+    'sensors': """
+        CREATE TABLE IF NOT EXISTS sensors (
+            id BIGSERIAL,
+            sensor_name VARCHAR(255) NOT NULL,
+            sensor_value FLOAT NOT NULL,
+            reading_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, reading_time)
+        ) PARTITION BY RANGE (reading_time);
+    """,
+    'status': """
+        CREATE TABLE IF NOT EXISTS status (
+            id BIGSERIAL,
+            agent_id INTEGER NOT NULL,
+            status VARCHAR(255) NOT NULL,
+            reading_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, reading_time)
+        ) PARTITION BY RANGE (reading_time);
+    """
+}
+TIMESERIES_COLUMNS = {
+    'sensors': ['sensor_name', 'sensor_value'],
+    'status': ['agent_id', 'status']
+}
+TIMESERIES_INDEXES = {
+    'sensors': {
+        'sensors_name_time_idx': """
+            CREATE INDEX IF NOT EXISTS sensors_name_time_idx
+            ON sensors (sensor_name, reading_time DESC, id DESC);
+        """
+    },
+    'status': {
+        'status_agent_time_idx': """
+            CREATE INDEX IF NOT EXISTS status_agent_time_idx
+            ON status (agent_id, reading_time DESC, id DESC);
+        """
+    }
+}
+SENSOR_ROLLUPS = {
+    'minute': 'sensor_rollup_1m',
+    'hour': 'sensor_rollup_1h'
+}
+
+# Raw rows and both rollups are written by one statement, so the rollups
+# never drift from the raw data. Rows are (sensor_name, sensor_value, reading_time).
+# The rollups upsert in key order so concurrent writers lock rows in the same
+# order and cannot deadlock each other.
+SENSOR_INSERT_TEMPLATE = "(%s, %s, COALESCE(%s::timestamp, LOCALTIMESTAMP))"
+SENSOR_INSERT_SQL = """
+    WITH inserted AS (
+        INSERT INTO sensors (sensor_name, sensor_value, reading_time)
+        VALUES %s
+        RETURNING sensor_name, sensor_value, reading_time
+    ), minute_rollup AS (
+        INSERT INTO sensor_rollup_1m AS rollup (sensor_name, bucket, min_value, max_value, sum_value, sample_count)
+        SELECT sensor_name, date_trunc('minute', reading_time),
+               MIN(sensor_value), MAX(sensor_value), SUM(sensor_value), COUNT(*)
+        FROM inserted
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (sensor_name, bucket) DO UPDATE SET
+            min_value = LEAST(rollup.min_value, EXCLUDED.min_value),
+            max_value = GREATEST(rollup.max_value, EXCLUDED.max_value),
+            sum_value = rollup.sum_value + EXCLUDED.sum_value,
+            sample_count = rollup.sample_count + EXCLUDED.sample_count
+    )
+    INSERT INTO sensor_rollup_1h AS rollup (sensor_name, bucket, min_value, max_value, sum_value, sample_count)
+    SELECT sensor_name, date_trunc('hour', reading_time),
+           MIN(sensor_value), MAX(sensor_value), SUM(sensor_value), COUNT(*)
+    FROM inserted
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (sensor_name, bucket) DO UPDATE SET
+        min_value = LEAST(rollup.min_value, EXCLUDED.min_value),
+        max_value = GREATEST(rollup.max_value, EXCLUDED.max_value),
+        sum_value = rollup.sum_value + EXCLUDED.sum_value,
+        sample_count = rollup.sample_count + EXCLUDED.sample_count
+"""
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(table, month):
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+def partition_month(table, name):
+    match = re.fullmatch(rf"{table}_y(\d{{4}})m(\d{{2}})", name)
+    if match:
+        return date(int(match.group(1)), int(match.group(2)), 1)
+    return None
+
+def connection_params(database):
+    return {
+        'host': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'port': os.environ.get('POSTGRES_PORT', '5433'),
+        'database': database,
+        'user': 'postgres',
+        'password': 'postgres',
+    }
+
 class DatabaseManager:
+    # One pool per process, shared by every DatabaseManager() instance.
+    # Handlers keep creating managers per request; that is now cheap.
+    _pool = None
+    _pool_slots = None
+    _last_used = {}
+    _ready = False
+    _bootstrap_lock = threading.RLock()
+
     def __init__(self):
-        self.connection = None
-        self.connect_to_default_database()
+        if not DatabaseManager._ready:
+            DatabaseManager.bootstrap()
 
-        try:
-            with self.connection.cursor() as cursor:
-                cursor.execute(sql.SQL("SELECT 1 FROM pg_database WHERE datname=%s"), ("smart_home_db", ))
-                result = cursor.fetchone()
-                if not result:
-                    cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier('smart_home_db')))
-                    logger.info("New database 'smart_home_db' created")
-            
-            self.connect_to_smart_home_database()
-            
-            self.init_tables_and_insert_test_data()
-            
-        except Exception as e:
-            logger.error(f"Error on insert test data from DatabaseManager(): {e}")
-            if self.connection:
-                self.connection.rollback()
-            
-        
+    @classmethod
+    def bootstrap(cls):
+        with cls._bootstrap_lock:
+            if cls._pool is not None:
+                return
+            try:
+                cls.create_smart_home_database_if_not_exists()
+                cls._pool = pool.ThreadedConnectionPool(
+                    POOL_MIN_SIZE,
+                    POOL_MAX_SIZE,
+                    cursor_factory=RealDictCursor,
+                    **connection_params("smart_home_db")
+                )
+                cls._pool_slots = threading.BoundedSemaphore(POOL_MAX_SIZE)
+                logger.info(f"Connection pool to 'smart_home_db' created (min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE})")
+            except Exception as e:
+                logger.error(f"Failed to create connection pool to 'smart_home_db': {e}")
+                return
 
-    def connect_to_default_database(self):
-        try:
-            host = os.environ.get('POSTGRES_HOST', 'localhost') 
-            port = os.environ.get('POSTGRES_PORT', '5433')
-            
-            self.connection = psycopg2.connect(
-                host=host,  
-                port=port,
-                database="postgres",
-                user="postgres",
-                password="postgres",
-                cursor_factory=RealDictCursor
-            )
-            self.connection.set_session(autocommit=True)
-            logger.info("Connected to default database successfully")
-        except Exception as e:
-            logger.error(f"Error on connecting to default database {e}")
+            cls().init_tables_and_insert_test_data()
+            cls._ready = True
 
-    def create_smart_home_database_if_not_exists(self):
+    @staticmethod
+    def create_smart_home_database_if_not_exists():
+        connection = psycopg2.connect(**connection_params("postgres"))
         try:
-            with self.connection.cursor() as cursor:
+            connection.set_session(autocommit=True)
+            with connection.cursor() as cursor:
                 cursor.execute(sql.SQL("SELECT 1 FROM pg_database WHERE datname=%s"), ("smart_home_db", ))
                 result = cursor.fetchone()
                 if not result:
@@ -61,32 +182,71 @@ class DatabaseManager:
                     logger.info("New database 'smart_home_db' created")
                 else:
                     logger.info("Database 'smart_home_db' already exists")
+        finally:
+            connection.close()
+
+    @classmethod
+    def _checkout(cls):
+        if cls._pool is None:
+            raise pool.PoolError("connection pool is not initialized")
+        if not cls._pool_slots.acquire(timeout=POOL_CHECKOUT_TIMEOUT):
+            raise pool.PoolError(f"no free connection in pool after {POOL_CHECKOUT_TIMEOUT} sec")
+
+        try:
+            for _ in range(POOL_MAX_SIZE + 1):
+                connection = cls._pool.getconn()
+                if cls._is_healthy(connection):
+                    return connection
+                logger.warning("Discarding broken connection from pool")
+                cls._last_used.pop(id(connection), None)
+                cls._pool.putconn(connection, close=True)
+            raise pool.PoolError("unable to get a healthy connection from pool")
+        except Exception:
+            cls._pool_slots.release()
+            raise
+
+    @classmethod
+    def _is_healthy(cls, connection):
+        if connection.closed:
+            return False
+        if time.monotonic() - cls._last_used.get(id(connection), 0) < POOL_PING_AFTER:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
         except Exception as e:
-            logger.error(f"Failed on creating 'smart_home_db': {e}")
-            
+            logger.warning(f"Pooled connection health-check failed: {e}")
+            return False
 
-    def connect_to_smart_home_database(self):
+    @classmethod
+    def _checkin(cls, connection):
         try:
-            host = os.environ.get('POSTGRES_HOST', 'localhost') 
-            port = os.environ.get('POSTGRES_PORT', '5433')      
-            
-            self.connection.close()
-            self.connection = psycopg2.connect(
-                host=host,  
-                port=port,  
-                database="smart_home_db",
-                user="postgres",
-                password="postgres",
-                cursor_factory=RealDictCursor
-            )
-            logger.info("Connection to 'smart_home_db' database established")
+            if connection.closed:
+                cls._last_used.pop(id(connection), None)
+                cls._pool.putconn(connection, close=True)
+                return
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            cls._last_used[id(connection)] = time.monotonic()
+            cls._pool.putconn(connection)
         except Exception as e:
-            logger.error(f"Failed to connect to 'smart_home_db': {e}")
-            
+            logger.error(f"Error returning connection to pool: {e}")
+        finally:
+            cls._pool_slots.release()
+
+    @contextmanager
+    def connection(self):
+        connection = self._checkout()
+        try:
+            yield connection
+        finally:
+            self._checkin(connection)
 
     def init_tables_and_insert_test_data(self):
         try:
-            with self.connection.cursor() as cursor:
+            with self.connection() as connection, connection.cursor() as cursor:
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS agents (
                         id SERIAL PRIMARY KEY,
@@ -96,14 +256,7 @@ class DatabaseManager:
                     );
                 """)
 
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS sensors (
-                        id SERIAL PRIMARY KEY,
-                        sensor_name VARCHAR(255) NOT NULL,
-                        sensor_value FLOAT NOT NULL,
-                        reading_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
+                self._prepare_timeseries_table(cursor, 'sensors')
 
                 cursor.execute("SELECT COUNT(*) FROM agents")
                 agent_count = cursor.fetchone()['count']
@@ -166,6 +319,11 @@ class DatabaseManager:
                 else:
                     logger.info("Agent data already exists")
 
+                cursor.execute("ALTER TABLE agents ADD COLUMN IF NOT EXISTS rules JSONB")
+                for role, rules in DEFAULT_RULES.items():
+                    cursor.execute("UPDATE agents SET rules = %s WHERE role = %s AND rules IS NULL",
+                                   (Json(rules), role))
+
                 cursor.execute("SELECT COUNT(*) FROM sensors")
                 sensor_count = cursor.fetchone()['count']
             
@@ -184,14 +342,7 @@ class DatabaseManager:
                 else:
                     logger.info("Sensor data already exists, skipping insertion")
 
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS status (
-                        id SERIAL PRIMARY KEY,
-                        agent_id SERIAL NOT NULL,
-                        status VARCHAR(255) NOT NULL,
-                        reading_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
+                self._prepare_timeseries_table(cursor, 'status')
                 cursor.execute("SELECT COUNT(*) FROM status")
                 status_count = cursor.fetchone()['count']
                 
@@ -208,22 +359,148 @@ class DatabaseManager:
                 else:
                     logger.info("Status data already exists, skipping insertion")
 
-                self.connection.commit()
+                self._prepare_rollup_tables(cursor)
+
+                connection.commit()
                 logger.info("Tables and test data created successfully")
         except Exception as e:
             logger.error(f"Error getting agent ID by role: {e}")
-            self.connection.rollback()
         
             
 
+    def _prepare_timeseries_table(self, cursor, table):
+        cursor.execute("""
+            SELECT c.relkind FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema() AND c.relname = %s
+            """, (table,))
+        row = cursor.fetchone()
+        legacy_table = f"{table}_legacy"
+        is_legacy = row is not None and row['relkind'] == 'r'
+
+        if is_legacy:
+            # Tables created before partitioning: move rows into the new layout
+            cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+                sql.Identifier(table), sql.Identifier(legacy_table)))
+            for index_name in TIMESERIES_INDEXES[table]:
+                cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(index_name)))
+            logger.info(f"Migrating table '{table}' to monthly partitions")
+
+        cursor.execute(TIMESERIES_TABLES[table])
+        cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT").format(
+            sql.Identifier(f"{table}_default"), sql.Identifier(table)))
+
+        first_month = None
+        if is_legacy:
+            cursor.execute(sql.SQL("SELECT date_trunc('month', MIN(reading_time))::date AS month FROM {}").format(
+                sql.Identifier(legacy_table)))
+            first_month = cursor.fetchone()['month']
+        self._ensure_partitions(cursor, table, first_month)
+
+        for index_sql in TIMESERIES_INDEXES[table].values():
+            cursor.execute(index_sql)
+
+        if is_legacy:
+            columns = TIMESERIES_COLUMNS[table]
+            cursor.execute(sql.SQL("""
+                INSERT INTO {table} (id, {columns}, reading_time)
+                SELECT id, {columns}, COALESCE(reading_time, LOCALTIMESTAMP) FROM {legacy}
+                """).format(
+                    table=sql.Identifier(table),
+                    legacy=sql.Identifier(legacy_table),
+                    columns=sql.SQL(', ').join(map(sql.Identifier, columns))))
+            cursor.execute(sql.SQL("SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(MAX(id), 1)) FROM {}").format(
+                sql.Identifier(table)), (table,))
+            cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(legacy_table)))
+            logger.info(f"Table '{table}' migrated to monthly partitions")
+
+    def _ensure_partitions(self, cursor, table, first_month=None):
+        cursor.execute("SELECT date_trunc('month', LOCALTIMESTAMP)::date AS month")
+        current_month = cursor.fetchone()['month']
+        month = min(first_month or current_month, current_month)
+        last_month = add_months(current_month, PARTITION_MONTHS_AHEAD)
+
+        while month <= last_month:
+            partition = partition_name(table, month)
+            try:
+                cursor.execute("SAVEPOINT create_partition")
+                cursor.execute(sql.SQL("""
+                    CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table}
+                    FOR VALUES FROM (%s) TO (%s)
+                    """).format(partition=sql.Identifier(partition), table=sql.Identifier(table)),
+                    (month, add_months(month, 1)))
+                cursor.execute("RELEASE SAVEPOINT create_partition")
+            except Exception as e:
+                # Rows for this month already landed in the default partition
+                cursor.execute("ROLLBACK TO SAVEPOINT create_partition")
+                logger.warning(f"Failed to create partition {partition}: {e}")
+            month = add_months(month, 1)
+
+    def _prepare_rollup_tables(self, cursor):
+        for rollup_table in SENSOR_ROLLUPS.values():
+            cursor.execute(sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {} (
+                    sensor_name VARCHAR(255) NOT NULL,
+                    bucket TIMESTAMP NOT NULL,
+                    min_value FLOAT NOT NULL,
+                    max_value FLOAT NOT NULL,
+                    sum_value FLOAT NOT NULL,
+                    sample_count INTEGER NOT NULL,
+                    PRIMARY KEY (sensor_name, bucket)
+                );
+                """).format(sql.Identifier(rollup_table)))
+
+        for precision, rollup_table in SENSOR_ROLLUPS.items():
+            cursor.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {}) AS filled").format(sql.Identifier(rollup_table)))
+            if cursor.fetchone()['filled']:
+                continue
+            cursor.execute(sql.SQL("""
+                INSERT INTO {} (sensor_name, bucket, min_value, max_value, sum_value, sample_count)
+                SELECT sensor_name, date_trunc(%s, reading_time),
+                       MIN(sensor_value), MAX(sensor_value), SUM(sensor_value), COUNT(*)
+                FROM sensors
+                GROUP BY 1, 2
+                """).format(sql.Identifier(rollup_table)), (precision,))
+            logger.info(f"Rollup table '{rollup_table}' filled from raw sensor data")
+
+    def maintain_timeseries(self):
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                cutoffs = {'sensors': SENSOR_RETENTION_DAYS, 'status': STATUS_RETENTION_DAYS}
+                for table, retention_days in cutoffs.items():
+                    self._ensure_partitions(cursor, table)
+
+                    cursor.execute("SELECT LOCALTIMESTAMP - make_interval(days => %s) AS cutoff", (retention_days,))
+                    cutoff = cursor.fetchone()['cutoff']
+                    cursor.execute("""
+                        SELECT c.relname FROM pg_inherits i
+                        JOIN pg_class c ON c.oid = i.inhrelid
+                        WHERE i.inhparent = %s::regclass
+                        """, (table,))
+                    for row in cursor.fetchall():
+                        month = partition_month(table, row['relname'])
+                        if month is not None and add_months(month, 1) <= cutoff.date():
+                            cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(row['relname'])))
+                            logger.info(f"Partition {row['relname']} dropped by retention policy")
+
+                    cursor.execute(sql.SQL("DELETE FROM {} WHERE reading_time < %s").format(
+                        sql.Identifier(f"{table}_default")), (cutoff,))
+
+                cursor.execute(sql.SQL("DELETE FROM {} WHERE bucket < LOCALTIMESTAMP - make_interval(days => %s)").format(
+                    sql.Identifier(SENSOR_ROLLUPS['minute'])), (ROLLUP_MINUTE_RETENTION_DAYS,))
+                connection.commit()
+        except Exception as e:
+            logger.error(f"Error on time-series maintenance: {e}")
+
+    def _load_agents(self):
+        with self.connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT * FROM agents ORDER BY id ASC")
+            return cursor.fetchall()
+
     def get_agent(self, agent_id: int) -> dict:
         try:
-            with self.connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT * FROM agents WHERE id = %s
-                """, (agent_id,))
-                
-                return cursor.fetchone()
+            agent_id = int(agent_id)
+            return next((agent for agent in AGENTS.get('all', self._load_agents) if agent['id'] == agent_id), None)
                 
         except Exception as e:
             logger.error(f"Error getting agent {e}")
@@ -231,9 +508,7 @@ class DatabaseManager:
 
     def get_all_agents(self) -> list:
         try:
-            with self.connection.cursor() as cursor:
-                cursor.execute("SELECT * FROM agents ORDER BY id ASC")
-                return cursor.fetchall()
+            return AGENTS.get('all', self._load_agents)
                 
         except Exception as e:
             logger.error(f"Error getting all agents {e}")
@@ -241,16 +516,7 @@ class DatabaseManager:
     
     def get_agent_id_by_role(self, role: str):
         try:
-            with self.connection.cursor() as cursor:
-                cursor.execute(
-                    """
-                    SELECT id FROM agents WHERE role = %s
-                    """,
-                    (role,)
-                )
-                result = cursor.fetchone()
-                if len(result)>0:
-                    return result['id']  
+            return next((agent['id'] for agent in AGENTS.get('all', self._load_agents) if agent['role'] == role), None)
                 
         except Exception as e:
             logger.error(f"Error getting agent ID by role: {e}")
@@ -261,33 +527,78 @@ class DatabaseManager:
             update_field = "system_prompt = %s"
             params = [prompt, agent_id]
 
-            with self.connection.cursor() as cursor:
+            with self.connection() as connection, connection.cursor() as cursor:
                 cursor.execute(f"""
                     UPDATE agents 
                     SET {update_field}
                     WHERE id = %s
                 """, params)
 
-                self.connection.commit()
+                connection.commit()
                 logger.info(f"Agent with ID: {agent_id} updated. New prompt set.")
-                return cursor.rowcount > 0 
+                updated = cursor.rowcount > 0
+            if updated:
+                self.agents_changed([agent_id], prompt_changed=True)
+            return updated
         except Exception as e:
             logger.error(f"Error updating agent: {e}")
-            self.connection.rollback()
             return False
 
+    def update_agent_rules(self, agent_id: int, rules: dict) -> bool:
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                cursor.execute("UPDATE agents SET rules = %s WHERE id = %s", (Json(rules), agent_id))
+                connection.commit()
+                logger.info(f"Agent with ID: {agent_id} updated. New rules set.")
+                updated = cursor.rowcount > 0
+            if updated:
+                self.agents_changed([agent_id])
+            return updated
+        except Exception as e:
+            logger.error(f"Error updating agent rules: {e}")
+            return False
+
+    def agents_changed(self, agent_ids, prompt_changed=False):
+        AGENTS.invalidate()
+        if prompt_changed:
+            for agent_id in agent_ids:
+                for hook in AGENT_UPDATE_HOOKS:
+                    hook(agent_id)
+        self.notify(CONFIG_CHANNEL, notification_payload('prompts' if prompt_changed else 'agents', agent_ids))
+
+    def notify(self, channel, payload):
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+                connection.commit()
+        except Exception as e:
+            logger.error(f"Error sending notification to {channel}: {e}")
+
     def get_agent_status(self, agent_id):
         try:
-            with self.connection.cursor() as cursor:
+            with self.connection() as connection, connection.cursor() as cursor:
                 cursor.execute("""SELECT * FROM status WHERE agent_id = %s
                     """, (agent_id,))
                 return cursor.fetchall()
         except Exception as e:
             logger.error(f"Error getting agent status: {e}")
             
+    def get_latest_statuses(self):
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT DISTINCT ON (agent_id) agent_id, status
+                    FROM status
+                    ORDER BY agent_id, reading_time DESC, id DESC
+                    """)
+                return {row['agent_id']: row['status'] for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"Error getting latest agent statuses: {e}")
+            return {}
+
     def insert_agent_status(self, agent_id, status):
         try:
-            with self.connection.cursor() as cursor:
+            with self.connection() as connection, connection.cursor() as cursor:
                 cursor.execute(
                     """
                     INSERT INTO status (agent_id, status)
@@ -295,16 +606,16 @@ class DatabaseManager:
                     """,
                     (agent_id, status,)
                 )
-            self.connection.commit()
+                connection.commit()
+            DASHBOARD.invalidate()
         
         except Exception as e:
             logger.error(f"Error inserting agent status value: {e}")
-            self.connection.rollback()
             
 
     def get_sensor_value(self, sensor_name):
         try:
-            with self.connection.cursor() as cursor:
+            with self.connection() as connection, connection.cursor() as cursor:
                 cursor.execute("""SELECT * FROM sensors WHERE sensor_name = %s
                     """, (sensor_name,))
                 return cursor.fetchall()
@@ -313,27 +624,222 @@ class DatabaseManager:
             logger.error(f"Error getting sensor value: {e}")
             
     
+    def get_recent_sensor_values(self, sensor_names, n):
+        # Last n readings of every requested sensor in one round trip,
+        # returned oldest first so they can be plotted as is.
+        recent = {name: [] for name in sensor_names}
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT requested.sensor_name, latest.sensor_value
+                    FROM unnest(%s::text[]) AS requested(sensor_name)
+                    CROSS JOIN LATERAL (
+                        SELECT sensor_value, reading_time, id
+                        FROM sensors
+                        WHERE sensors.sensor_name = requested.sensor_name
+                        ORDER BY reading_time DESC, id DESC
+                        LIMIT %s
+                    ) AS latest
+                    ORDER BY requested.sensor_name, latest.reading_time ASC, latest.id ASC
+                    """, (list(sensor_names), n))
+                for row in cursor.fetchall():
+                    recent[row['sensor_name']].append(row['sensor_value'])
+        except Exception as e:
+            logger.error(f"Error getting recent sensor values: {e}")
+        return recent
+
+    def get_sensor_series(self, sensor_name, start, end):
+        # Short windows come from raw readings, longer ones from rollups
+        window = end - start
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                if window <= RAW_SERIES_WINDOW:
+                    resolution = 'raw'
+                    cursor.execute("""
+                        SELECT reading_time AS time, sensor_value AS value,
+                               sensor_value AS min, sensor_value AS max, 1 AS count
+                        FROM sensors
+                        WHERE sensor_name = %s AND reading_time >= %s AND reading_time < %s
+                        ORDER BY reading_time ASC, id ASC
+                        """, (sensor_name, start, end))
+                else:
+                    resolution = 'minute' if window <= MINUTE_ROLLUP_WINDOW else 'hour'
+                    cursor.execute(sql.SQL("""
+                        SELECT bucket AS time, sum_value / sample_count AS value,
+                               min_value AS min, max_value AS max, sample_count AS count
+                        FROM {}
+                        WHERE sensor_name = %s AND bucket >= date_trunc(%s, %s::timestamp) AND bucket < %s
+                        ORDER BY bucket ASC
+                        """).format(sql.Identifier(SENSOR_ROLLUPS[resolution])),
+                        (sensor_name, resolution, start, end))
+                return resolution, cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting sensor series: {e}")
+            return None, []
+
+    def get_sensor_last_reading(self, sensor_name):
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT reading_time, id FROM sensors
+                    WHERE sensor_name = %s
+                    ORDER BY reading_time DESC, id DESC
+                    LIMIT 1
+                    """, (sensor_name,))
+                row = cursor.fetchone()
+                return (row['reading_time'], row['id']) if row else None
+        except Exception as e:
+            logger.error(f"Error getting last sensor reading: {e}")
+            return None
+
+    def get_sensor_stats(self, sensor_name, start, end):
+        window = end - start
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                if window <= RAW_SERIES_WINDOW:
+                    cursor.execute("""
+                        SELECT MIN(sensor_value) AS min, MAX(sensor_value) AS max,
+                               AVG(sensor_value) AS avg, COUNT(*) AS count
+                        FROM sensors
+                        WHERE sensor_name = %s AND reading_time >= %s AND reading_time < %s
+                        """, (sensor_name, start, end))
+                else:
+                    resolution = 'minute' if window <= MINUTE_ROLLUP_WINDOW else 'hour'
+                    cursor.execute(sql.SQL("""
+                        SELECT MIN(min_value) AS min, MAX(max_value) AS max,
+                               SUM(sum_value) / NULLIF(SUM(sample_count), 0) AS avg,
+                               COALESCE(SUM(sample_count), 0) AS count
+                        FROM {}
+                        WHERE sensor_name = %s AND bucket >= date_trunc(%s, %s::timestamp) AND bucket < %s
+                        """).format(sql.Identifier(SENSOR_ROLLUPS[resolution])),
+                        (sensor_name, resolution, start, end))
+                return cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Error getting sensor stats: {e}")
+
+    def get_sensor_values(self, sensor_name, start, end):
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT sensor_value FROM sensors
+                    WHERE sensor_name = %s AND reading_time >= %s AND reading_time < %s
+                    """, (sensor_name, start, end))
+                return [row['sensor_value'] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting sensor values: {e}")
+            return []
+
     def insert_sensor_value(self, sensor_name, sensor_value):
         try:
-            with self.connection.cursor() as cursor:
-                cursor.execute(
-                    """
-                    INSERT INTO sensors (sensor_name, sensor_value)
-                    VALUES (%s, %s);
-                    """,
-                    (sensor_name, sensor_value,)
-                )
-            self.connection.commit()
+            with self.connection() as connection, connection.cursor() as cursor:
+                execute_values(cursor, SENSOR_INSERT_SQL, [(sensor_name, sensor_value, None)],
+                               template=SENSOR_INSERT_TEMPLATE)
+                connection.commit()
+            DASHBOARD.invalidate()
         
         except Exception as e:
             logger.error(f"Error inserting sensor value: {e}")
-            self.connection.rollback()
             
 
+    def insert_cycle(self, readings, statuses=()):
+        # readings: (sensor_name, sensor_value, reading_time or None)
+        # statuses: (agent_id, status)
+        readings = list(readings)
+        statuses = list(statuses)
+        if not readings and not statuses:
+            return 0
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                if readings:
+                    execute_values(cursor, SENSOR_INSERT_SQL, readings,
+                                   template=SENSOR_INSERT_TEMPLATE, page_size=INSERT_PAGE_SIZE)
+                if statuses:
+                    execute_values(cursor, "INSERT INTO status (agent_id, status) VALUES %s",
+                                   statuses, page_size=INSERT_PAGE_SIZE)
+                connection.commit()
+            DASHBOARD.invalidate()
+            return len(readings) + len(statuses)
+        except Exception as e:
+            logger.error(f"Error inserting cycle data: {e}")
+            return None
+
     def close(self):
-        if self.connection:
-            self.connection.close()
-            logger.info("PostgreSQL connection closed")
+        with DatabaseManager._bootstrap_lock:
+            if DatabaseManager._pool is not None:
+                DatabaseManager._pool.closeall()
+                DatabaseManager._pool = None
+                DatabaseManager._ready = False
+                DatabaseManager._last_used.clear()
+                logger.info("PostgreSQL connection pool closed")
+
+def handle_config_notification(payload):
+    # payload None means notifications may have been missed, drop everything
+    message = json.loads(payload) if payload else {}
+    if message.get('origin') == ORIGIN:
+        return
+    kind = message.get('kind')
+    keys = message.get('keys')
+    if kind in (None, 'settings'):
+        SETTINGS.invalidate(keys if kind else None)
+    if kind in (None, 'agents', 'prompts'):
+        AGENTS.invalidate()
+    if kind == 'prompts':
+        for agent_id in keys or []:
+            for hook in AGENT_UPDATE_HOOKS:
+                hook(agent_id)
+    logger.info(f"Config caches invalidated by {message.get('origin', 'reconnect')}: {kind} {keys}")
+
+class NotificationListener:
+    # LISTENs on its own autocommit connection, outside the pool
+    def __init__(self, channel, callback, database="smart_home_db", reconnect_delay=5):
+        self.channel = channel
+        self.callback = callback
+        self.database = database
+        self.reconnect_delay = reconnect_delay
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=f"listen-{self.channel}", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        first = True
+        while not self._stopping.is_set():
+            connection = None
+            try:
+                connection = psycopg2.connect(**connection_params(self.database))
+                connection.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as cursor:
+                    cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+                logger.info(f"Listening for notifications on {self.channel}")
+                if not first:
+                    self.callback(None)
+                first = False
+                while not self._stopping.is_set():
+                    if select.select([connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notification = connection.notifies.pop(0)
+                        try:
+                            self.callback(notification.payload)
+                        except Exception as e:
+                            logger.error(f"Error handling notification on {self.channel}: {e}")
+            except Exception as e:
+                logger.error(f"Notification listener on {self.channel} failed: {e}")
+                first = False
+                self._stopping.wait(self.reconnect_delay)
+            finally:
+                if connection is not None:
+                    connection.close()
 
 def wait_for_postgres(max_retries=10, retry_delay=2):
     for attempt in range(max_retries):
@@ -0,0 +1,120 @@
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+StageResult = namedtuple('StageResult', ['status', 'value', 'error', 'duration'])
+
+STAGE_OK = 'ok'
+STAGE_FAILED = 'failed'
+STAGE_TIMEOUT = 'timeout'
+STAGE_SKIPPED = 'skipped'
+STAGE_CANCELLED = 'cancelled'
+
+class Stage:
+    def __init__(self, name, func, depends_on=(), timeout=60):
+        # func receives a dict {dependency name: dependency value}
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.timeout = timeout
+
+class Pipeline:
+    # Runs a DAG of stages, each one as soon as all its dependencies have
+    # succeeded. A failed, timed out or cancelled stage only skips the
+    # stages that depend on it.
+    def __init__(self, name, stages):
+        self.name = name
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage '{stage.name}' in pipeline '{name}'")
+            self.stages[stage.name] = stage
+        for stage in stages:
+            for dependency in stage.depends_on:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dependency}'")
+        self._check_acyclic()
+        self._cancel_event = threading.Event()
+
+    def _check_acyclic(self):
+        resolved = set()
+        remaining = dict(self.stages)
+        while remaining:
+            ready = [name for name, stage in remaining.items() if set(stage.depends_on) <= resolved]
+            if not ready:
+                raise ValueError(f"Pipeline '{self.name}' has a dependency cycle: {', '.join(remaining)}")
+            for name in ready:
+                resolved.add(name)
+                del remaining[name]
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def run(self):
+        self._cancel_event.clear()
+        results = {}
+        running = {}
+        pending = list(self.stages.values())
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.stages), thread_name_prefix=f"{self.name}-stage")
+        started = time.monotonic()
+
+        try:
+            while pending or running:
+                for stage in list(pending):
+                    if not all(dependency in results for dependency in stage.depends_on):
+                        continue
+                    pending.remove(stage)
+                    failed = [d for d in stage.depends_on if results[d].status != STAGE_OK]
+                    if self.cancelled:
+                        results[stage.name] = StageResult(STAGE_CANCELLED, None, None, 0.0)
+                    elif failed:
+                        results[stage.name] = StageResult(
+                            STAGE_SKIPPED, None, f"dependency failed: {', '.join(failed)}", 0.0)
+                        logger.warning(f"Stage {stage.name} skipped, failed dependencies: {', '.join(failed)}")
+                    else:
+                        inputs = {d: results[d].value for d in stage.depends_on}
+                        future = executor.submit(stage.func, inputs)
+                        running[future] = (stage, time.monotonic())
+
+                if not running:
+                    continue
+
+                now = time.monotonic()
+                next_deadline = min(begin + stage.timeout for stage, begin in running.values())
+                done, _ = concurrent.futures.wait(
+                    running, timeout=min(max(next_deadline - now, 0), 1.0),
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+
+                now = time.monotonic()
+                for future in list(running):
+                    stage, begin = running[future]
+                    duration = now - begin
+                    if future in done:
+                        del running[future]
+                        try:
+                            results[stage.name] = StageResult(STAGE_OK, future.result(), None, duration)
+                        except Exception as e:
+                            results[stage.name] = StageResult(STAGE_FAILED, None, e, duration)
+                            logger.error(f"Stage {stage.name} failed after {duration:.2f} sec: {e}")
+                    elif self.cancelled or duration >= stage.timeout:
+                        # A running thread cannot be interrupted; its result is dropped
+                        del running[future]
+                        future.cancel()
+                        status = STAGE_CANCELLED if self.cancelled else STAGE_TIMEOUT
+                        results[stage.name] = StageResult(status, None, None, duration)
+                        logger.error(f"Stage {stage.name} {status} after {duration:.2f} sec")
+        finally:
+            executor.shutdown(wait=False)
+
+        logger.info(f"Pipeline {self.name} finished in {time.monotonic() - started:.2f} sec: "
+                    + ", ".join(f"{name}={result.status} ({result.duration:.2f} sec)" for name, result in results.items()))
+        return results
@@ -0,0 +1,128 @@
+import json
+import threading
+
+import numpy as np
+
+STATUS_NORMAL = 'normal'
+STATUS_WARNING = 'warning'
+STATUS_CRITICAL = 'critical'
+STATUSES = (STATUS_NORMAL, STATUS_WARNING, STATUS_CRITICAL)
+
+# When to still ask the LLM after the rules have classified the readings
+ESCALATE_NEVER = 'never'
+ESCALATE_BOUNDARY = 'boundary'  # only if a reading is close to a threshold
+ESCALATE_ALWAYS = 'always'
+
+# Thresholds from the life-agent and eco-agent prompts. A reading inside
+# "normal" is normal, outside "critical" is critical, warning in between.
+# null means the side is unbounded.
+DEFAULT_RULES = {
+    'life-agent': {
+        'escalate': ESCALATE_BOUNDARY,
+        'margin': 0.02,
+        'sensors': {
+            'temp': {'normal': [15, 30], 'critical': [10, 35]},
+            'humidity': {'normal': [40, 70], 'critical': [25, 85]},
+            'light': {'normal': [8000, 12000], 'critical': [6500, 14000]},
+            'co2': {'normal': [None, 800], 'critical': [None, 1500]},
+        },
+    },
+    'eco-agent': {
+        'escalate': ESCALATE_BOUNDARY,
+        'margin': 0.02,
+        'sensors': {
+            'DO': {'normal': [5, 10], 'critical': [4.5, 11]},
+            'EC': {'normal': [0.7, 2.5], 'critical': [0.5, 2.8]},
+            'ph': {'normal': [5.5, 6.5], 'critical': [5.0, 7.0]},
+        },
+    },
+}
+
+def _bound(value, default):
+    return default if value is None else float(value)
+
+class RuleSet:
+    # Rules compiled to per-sensor threshold arrays so a whole batch of
+    # readings (one row per station) is classified with a few array ops.
+    def __init__(self, definition):
+        sensors = definition.get('sensors') or {}
+        if not sensors:
+            raise ValueError("Rules must define at least one sensor")
+        self.escalate = definition.get('escalate', ESCALATE_BOUNDARY)
+        if self.escalate not in (ESCALATE_NEVER, ESCALATE_BOUNDARY, ESCALATE_ALWAYS):
+            raise ValueError(f"Unknown escalate mode: {self.escalate}")
+        self.margin = float(definition.get('margin', 0.02))
+        self.names = list(sensors)
+
+        bounds = []
+        for name in self.names:
+            rule = sensors[name]
+            normal_low, normal_high = rule['normal']
+            critical_low, critical_high = rule.get('critical') or [None, None]
+            row = [
+                _bound(critical_low, -np.inf), _bound(normal_low, -np.inf),
+                _bound(normal_high, np.inf), _bound(critical_high, np.inf),
+            ]
+            if not row[0] <= row[1] <= row[2] <= row[3]:
+                raise ValueError(f"Thresholds for sensor '{name}' are not ordered")
+            bounds.append(row)
+        self.critical_low, self.normal_low, self.normal_high, self.critical_high = np.array(bounds).T
+
+        finite_low = np.where(np.isfinite(self.normal_low), self.normal_low, 0.0)
+        finite_high = np.where(np.isfinite(self.normal_high), self.normal_high, 0.0)
+        width = np.abs(finite_high - finite_low)
+        self.tolerance = self.margin * np.where(width > 0, width, 1.0)
+
+    def evaluate(self, values):
+        # values: array (stations, sensors) in self.names order.
+        # Returns severity per station (index into STATUSES) and whether
+        # any of its readings is within the margin of a threshold.
+        values = np.atleast_2d(np.asarray(values, dtype=float))
+        severity = np.ones(values.shape, dtype=int)
+        severity[(values >= self.normal_low) & (values <= self.normal_high)] = 0
+        severity[(values < self.critical_low) | (values > self.critical_high)] = 2
+        # Unparsable readings are treated as critical
+        severity[np.isnan(values)] = 2
+
+        thresholds = np.stack([self.critical_low, self.normal_low, self.normal_high, self.critical_high])
+        with np.errstate(invalid='ignore'):
+            distance = np.abs(values[:, None, :] - thresholds[None, :, :])
+        near = (distance <= self.tolerance).any(axis=(1, 2))
+        return severity.max(axis=1), near
+
+    def to_array(self, readings):
+        row = []
+        for name in self.names:
+            try:
+                row.append(float(readings[name]))
+            except (KeyError, TypeError, ValueError):
+                row.append(np.nan)
+        return np.array([row])
+
+    def classify(self, readings):
+        severity, near = self.evaluate(self.to_array(readings))
+        return STATUSES[int(severity[0])], bool(near[0])
+
+    def needs_llm(self, near_boundary):
+        if self.escalate == ESCALATE_ALWAYS:
+            return True
+        return self.escalate == ESCALATE_BOUNDARY and near_boundary
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+def compile_rules(definition):
+    # Rules come from the agents table on every cycle; compile each
+    # distinct definition once
+    if definition is None:
+        return None
+    if isinstance(definition, str):
+        definition = json.loads(definition)
+    key = json.dumps(definition, sort_keys=True)
+    with _compiled_lock:
+        rule_set = _compiled.get(key)
+        if rule_set is None:
+            if len(_compiled) > 32:
+                _compiled.clear()
+            rule_set = _compiled[key] = RuleSet(definition)
+        return rule_set
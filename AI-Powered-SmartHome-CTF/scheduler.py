@@ -0,0 +1,162 @@
+import heapq
+import itertools
+import logging
+import math
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+FIXED_RATE = 'fixed_rate'
+FIXED_DELAY = 'fixed_delay'
+
+# What a fixed-rate job does when a run ends after its next slot has passed
+MISSED_SKIP = 'skip'          # drop the missed slots, wait for the next one
+MISSED_RUN_ONCE = 'run_once'  # run once right away, then continue from there
+MISSED_CATCH_UP = 'catch_up'  # run every missed slot back to back
+
+class Job:
+    def __init__(self, name, func, interval, mode, jitter, missed_runs):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.mode = mode
+        self.jitter = jitter
+        self.missed_runs = missed_runs
+        self.scheduled = None
+        self.due = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.last_lag = None
+        self.max_lag = 0.0
+        self.last_error = None
+        self.last_run = None
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'mode': self.mode,
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'last_duration': self.last_duration,
+            'max_duration': self.max_duration,
+            'last_lag': self.last_lag,
+            'max_lag': self.max_lag,
+            'last_error': self.last_error,
+            'last_run': self.last_run,
+            'next_run_in': None if self.due is None else max(self.due - time.monotonic(), 0.0),
+        }
+
+class Scheduler:
+    # Runs every job on one worker thread, so a job never overlaps itself
+    # or another job. A long run delays the jobs behind it; their lag
+    # shows up in stats().
+    def __init__(self, name='scheduler'):
+        self.name = name
+        self._jobs = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def add_job(self, name, func, interval, mode=FIXED_RATE, jitter=0.0,
+                missed_runs=MISSED_SKIP, start_delay=0.0):
+        if mode not in (FIXED_RATE, FIXED_DELAY):
+            raise ValueError(f"Unknown schedule mode: {mode}")
+        if missed_runs not in (MISSED_SKIP, MISSED_RUN_ONCE, MISSED_CATCH_UP):
+            raise ValueError(f"Unknown missed runs policy: {missed_runs}")
+        with self._condition:
+            if name in self._jobs:
+                raise ValueError(f"Job '{name}' is already scheduled")
+            job = Job(name, func, interval, mode, jitter, missed_runs)
+            self._jobs[name] = job
+            self._schedule(job, time.monotonic() + start_delay, jitter=False)
+            self._condition.notify()
+        logger.info(f"Job {name} scheduled every {interval} sec ({mode})")
+        return job
+
+    def _schedule(self, job, scheduled, jitter=True):
+        job.scheduled = scheduled
+        job.due = scheduled + (random.uniform(0, job.jitter) if jitter and job.jitter else 0.0)
+        heapq.heappush(self._heap, (job.due, next(self._sequence), job))
+
+    def _next_slot(self, job, finished):
+        if job.mode == FIXED_DELAY:
+            return finished + job.interval
+
+        scheduled = job.scheduled + job.interval
+        if scheduled >= finished:
+            return scheduled
+        missed = math.ceil((finished - scheduled) / job.interval)
+        if job.missed_runs == MISSED_CATCH_UP:
+            return scheduled
+        job.skipped += missed
+        if job.missed_runs == MISSED_RUN_ONCE:
+            logger.warning(f"Job {job.name} missed {missed} run(s), running once now")
+            return finished
+        logger.warning(f"Job {job.name} missed {missed} run(s), skipping to the next slot")
+        return scheduled + missed * job.interval
+
+    def start(self):
+        with self._condition:
+            if self.running:
+                return False
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        logger.info(f"Scheduler {self.name} started")
+        return True
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        logger.info(f"Scheduler {self.name} stopped")
+
+    def stats(self):
+        with self._condition:
+            return {name: job.stats() for name, job in self._jobs.items()}
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopping and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+                if self._stopping:
+                    return
+                due, _, job = heapq.heappop(self._heap)
+
+            started = time.monotonic()
+            lag = started - due
+            try:
+                job.func()
+                job.last_error = None
+            except Exception as e:
+                job.failures += 1
+                job.last_error = str(e)
+                logger.error(f"Error in scheduled job {job.name}: {e}")
+            finished = time.monotonic()
+
+            with self._condition:
+                job.runs += 1
+                job.last_run = time.time()
+                job.last_duration = finished - started
+                job.max_duration = max(job.max_duration, job.last_duration)
+                job.last_lag = lag
+                job.max_lag = max(job.max_lag, lag)
+                self._schedule(job, self._next_slot(job, finished))
+            logger.info(f"Job {job.name} finished in {job.last_duration:.2f} sec, lag {lag:.2f} sec, "
+                        f"next run in {max(job.due - finished, 0):.0f} sec")
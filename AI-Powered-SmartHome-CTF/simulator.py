@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+
+import numpy as np
+
+# Same ranges the randomizer-agent prompt asks for: (low, high, decimals)
+SENSOR_RANGES = {
+    "temp": (15, 40, 0),
+    "humidity": (0, 100, 0),
+    "light": (6000, 15000, 0),
+    "co2": (0, 2000, 0),
+    "DO": (4, 12, 1),
+    "EC": (0.7, 3, 2),
+    "ph": (4.5, 6, 2),
+}
+
+MODEL_UNIFORM = 'uniform'
+MODEL_RANDOM_WALK = 'random_walk'
+MODEL_DIURNAL = 'diurnal'
+
+def load_ranges(overrides=None):
+    # overrides: JSON object {"temp": [18, 30]} or {"temp": [18, 30, 1]}
+    ranges = dict(SENSOR_RANGES)
+    if overrides:
+        for name, bounds in json.loads(overrides).items():
+            low, high = float(bounds[0]), float(bounds[1])
+            if low > high:
+                raise ValueError(f"Invalid range for sensor '{name}': {low} > {high}")
+            decimals = int(bounds[2]) if len(bounds) > 2 else ranges.get(name, (0, 0, 2))[2]
+            ranges[name] = (low, high, decimals)
+    return ranges
+
+class SensorSimulator:
+    def __init__(self, ranges=None, model=MODEL_UNIFORM, step=0.05, diurnal_amplitude=0.3, seed=None):
+        if model not in (MODEL_UNIFORM, MODEL_RANDOM_WALK, MODEL_DIURNAL):
+            raise ValueError(f"Unknown simulator model: {model}")
+        ranges = ranges or SENSOR_RANGES
+        self.names = list(ranges)
+        self.model = model
+        self.low = np.array([ranges[name][0] for name in self.names], dtype=float)
+        self.high = np.array([ranges[name][1] for name in self.names], dtype=float)
+        self.decimals = np.array([ranges[name][2] for name in self.names], dtype=int)
+        self.span = self.high - self.low
+        self.step = step
+        self.diurnal_amplitude = diurnal_amplitude
+        self._rng = np.random.default_rng(seed)
+        self._state = None
+        self._lock = threading.Lock()
+
+    def generate(self, stations=1, at=None):
+        # One row per station, one column per sensor in self.names
+        shape = (stations, len(self.names))
+        with self._lock:
+            if self.model == MODEL_UNIFORM:
+                values = self._rng.uniform(self.low, self.high, size=shape)
+            elif self.model == MODEL_RANDOM_WALK:
+                if self._state is None or self._state.shape != shape:
+                    self._state = self._rng.uniform(self.low, self.high, size=shape)
+                else:
+                    self._state = self._state + self._rng.normal(0.0, self.step * self.span, size=shape)
+                    # Reflect at the bounds instead of sticking to them
+                    self._state = np.where(self._state > self.high, 2 * self.high - self._state, self._state)
+                    self._state = np.where(self._state < self.low, 2 * self.low - self._state, self._state)
+                    self._state = np.clip(self._state, self.low, self.high)
+                values = self._state
+            else:
+                seconds = time.time() if at is None else at
+                hour = (seconds % 86400) / 3600.0
+                # Peak in the afternoon, minimum before dawn
+                wave = np.sin(2 * np.pi * (hour - 8.0) / 24.0)
+                center = self.low + self.span * (0.5 + self.diurnal_amplitude * wave)
+                values = center + self._rng.normal(0.0, self.step * self.span, size=shape)
+            values = np.clip(values, self.low, self.high)
+
+        scale = np.power(10.0, self.decimals)
+        return np.round(values * scale) / scale
+
+    def readings(self, row):
+        return {
+            name: (int(value) if decimals == 0 else float(value))
+            for name, value, decimals in zip(self.names, row, self.decimals)
+        }
+
+    def sample(self):
+        return self.readings(self.generate(1)[0])
+
+    def sample_many(self, stations):
+        return [self.readings(row) for row in self.generate(stations)]
@@ -0,0 +1,123 @@
+import concurrent.futures
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+logger = logging.getLogger(__name__)
+
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))
+# WAL lets readers run while the writer commits; NORMAL sync is durable in WAL mode
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('busy_timeout', SQLITE_BUSY_TIMEOUT),
+    ('synchronous', 'NORMAL'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -16000),
+)
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+class SQLiteWriter:
+    # The only thread that writes to the database, over a connection of its
+    # own so busy request threads cannot starve it of one. A job is a function
+    # taking a session; jobs waiting in the queue are run together and
+    # committed once. If that commit fails every job is retried on its own,
+    # so one bad job does not take the others down with it.
+    def __init__(self, name, bind, max_batch=64):
+        self.name = name
+        self._bind = bind
+        self._sessionmaker = sessionmaker(expire_on_commit=False)
+        self._connection = None
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.jobs = 0
+        self.batches = 0
+        self.retried = 0
+        self.failed = 0
+
+    def submit(self, func, *args):
+        future = concurrent.futures.Future()
+        self._ensure_thread()
+        self._queue.put((future, func, args))
+        return future
+
+    def run(self, func, *args):
+        if threading.current_thread() is self._thread:
+            raise RuntimeError(f"{self.name} jobs cannot wait for other jobs")
+        return self.submit(func, *args).result()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [job for job in batch if job[0].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            if not self._commit(batch) and len(batch) > 1:
+                self.retried += len(batch)
+                for job in batch:
+                    self._commit([job])
+
+    def _commit(self, batch):
+        session = None
+        try:
+            if self._connection is None:
+                self._connection = self._bind().connect()
+            session = self._sessionmaker(bind=self._connection)
+            results = [func(session, *args) for _, func, args in batch]
+            session.commit()
+        except Exception as e:
+            if session is not None:
+                session.rollback()
+            if self._connection is not None and self._connection.invalidated:
+                self._connection.close()
+                self._connection = None
+            if len(batch) == 1:
+                self.failed += 1
+                logger.error(f"Error in {self.name} job: {e}")
+                batch[0][0].set_exception(e)
+            return False
+        finally:
+            if session is not None:
+                session.close()
+        self.jobs += len(batch)
+        self.batches += 1
+        for (future, _, _), result in zip(batch, results):
+            future.set_result(result)
+        return True
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'jobs': self.jobs,
+            'batches': self.batches,
+            'retried': self.retried,
+            'failed': self.failed,
+        }